@@ -0,0 +1,209 @@
+import asyncio
+from constants import REQUEST_LEN
+from cards import Shoe
+from gamelog import logger
+import metrics
+import protocol
+import recording
+import timers
+from server import BlackjackGame, CLIENT_TIMEOUT, HANDSHAKE_TIMEOUT, IDLE_TIMEOUT, MultiTableGame
+
+REJECT_TIMEOUT = 0.5  # Seconds a rejected client has to send its request before the connection closes
+
+
+async def handle_client_async(reader, writer, make_shoe=Shoe, handshake_timeout=HANDSHAKE_TIMEOUT,
+                              decision_timeout=CLIENT_TIMEOUT, wheel=None, idle_timeout=IDLE_TIMEOUT):
+    """
+    Asyncio server: plays a whole game as a coroutine, then more games on the same connection
+    while the client's requests ask to keep it alive.
+    Same round logic as server.handle_client, driven through a StreamReader/StreamWriter.
+    The StreamReader keeps its own receive buffer, so readexactly() already yields whole frames.
+    Deadlines are enforced by a timer wheel rather than wait_for(), which costs a task and a
+    timer handle per read.
+    :param wheel: timers.TimerWheel, the process's shared wheel by default
+    """
+    addr = writer.get_extra_info("peername")
+    session = recording.session(make_shoe)  # None unless the server records sessions (--record)
+    if session is not None:
+        make_shoe = session.shoe
+    game = BlackjackGame(addr, make_shoe())
+    game.log("Client connected from %s", addr)
+    metrics.ACTIVE_CONNECTIONS.inc()
+
+    loop = asyncio.get_running_loop()
+    wheel = wheel or timers.shared_wheel()
+    expired = False
+
+    def cut_off():
+        nonlocal expired
+        expired = True
+        writer.transport.abort()  # A pending read fails with IncompleteReadError
+
+    # Transports may hold on to the data until the socket is writable, so hand them a
+    # copy of the game's buffer - still one write per game step.
+    def write(view):
+        writer.write(bytes(view))
+
+    # The wheel may run in another thread
+    deadline = wheel.schedule(handshake_timeout, lambda: loop.call_soon_threadsafe(cut_off))
+    kept_alive = False  # Waiting for the next request of a kept-alive connection
+    try:
+        while True:
+            try:
+                # Receive Request (Header + Name)
+                # Cookie(4), Type(1), Rounds(1), Name(32) = 38 bytes
+                req_data = await reader.readexactly(REQUEST_LEN)
+            except asyncio.IncompleteReadError as e:
+                req_data = e.partial
+            if kept_alive:
+                if expired:
+                    game.log("Kept-alive connection idle for %gs, closing it.", idle_timeout)
+                    metrics.IDLE_TIMEOUTS.inc()
+                    return
+                if len(req_data) < REQUEST_LEN:
+                    return  # The client is done with the connection
+                metrics.KEEP_ALIVE_GAMES.inc()
+            elif expired:
+                game.warning("Timeout waiting for handshake data.")
+                metrics.HANDSHAKE_TIMEOUTS.inc()
+                return
+            if protocol.is_tables_request(req_data):
+                game = MultiTableGame(game, make_shoe)
+            if session is not None:
+                game = session.wrap(game)
+            if not game.handshake(req_data):
+                return
+
+            # Send initial cards to client
+            wheel.reschedule(deadline, decision_timeout)
+            game.start()
+            game.flush(write)
+            await writer.drain()
+
+            # Game Loop: each decision gets all of its payloads in one write
+            while not game.finished:
+                try:
+                    # Wait for player decision
+                    data = await reader.readexactly(game.decision_len)
+                except asyncio.IncompleteReadError:
+                    if expired:
+                        game.warning("Timeout waiting for decision, game reclaimed.")
+                        metrics.DECISION_TIMEOUTS.inc()
+                    else:
+                        game.warning("Connection lost.")
+                    return
+
+                wheel.reschedule(deadline, decision_timeout)
+                game.decide(data)
+                game.flush(write)
+                await writer.drain()
+            game.game_over()
+            if session is not None:
+                session.save()  # A record per game, a kept-alive connection is not held in memory
+            if not game.keep_alive:
+                return
+
+            # Same connection, next game: the client has idle_timeout to send its request
+            wheel.reschedule(deadline, idle_timeout)
+            game.close()
+            game = BlackjackGame(addr, make_shoe())
+            kept_alive = True
+
+    except Exception as e:
+        game.warning("Error handling client %s: %s", addr, e)
+    finally:
+        wheel.cancel(deadline)
+        writer.close()
+        game.close()
+        if session is not None:
+            session.save()
+        metrics.ACTIVE_CONNECTIONS.dec()
+        game.log("Client %s closed.", addr)
+
+
+async def reject(reader, writer):
+    """
+    Turn a connection away with a BUSY payload, waiting at most REJECT_TIMEOUT on the client.
+    """
+    metrics.REJECTED.inc()
+    logger.info("Server full, rejected %s.", writer.get_extra_info("peername"))
+    try:
+        writer.write(protocol.BUSY_PAYLOAD)
+        # Read the request first, as server.reject does: closing with unread data resets the
+        # connection, and the client could lose the BUSY payload
+        await asyncio.wait_for(reader.read(REQUEST_LEN), REJECT_TIMEOUT)
+        writer.write_eof()
+    except (OSError, asyncio.TimeoutError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(tcp_sock, config, stop_signals=()):
+    """
+    Serve games on an already bound listening socket until one of the stop signals.
+    Admission works as in server.serve_threaded.
+    On a stop signal it stops accepting and gives running games config.grace seconds to finish.
+    :param tcp_sock: Listening TCP socket
+    :param config: server.ServerConfig
+    :param stop_signals: Signals that stop the server
+    """
+    make_shoe = config.shoe_factory()
+    slots = asyncio.Semaphore(config.max_games) if config.max_games else None
+    limit = config.admission_limit()
+    admitted = 0
+    games = set()
+    # Driven by this loop, so deadline callbacks run in the loop thread
+    wheel = timers.TimerWheel()
+    ticker = asyncio.create_task(wheel.run_async())
+
+    async def play(reader, writer):
+        await handle_client_async(reader, writer, make_shoe, config.handshake_timeout,
+                                  config.decision_timeout, wheel, config.idle_timeout)
+
+    async def on_connect(reader, writer):
+        nonlocal admitted
+        if limit and admitted >= limit:
+            await reject(reader, writer)
+            return
+        admitted += 1
+        games.add(asyncio.current_task())
+        try:
+            if slots is None:
+                await play(reader, writer)
+                return
+            # Extra connections wait here until a game ends, or are turned away
+            try:
+                await asyncio.wait_for(slots.acquire(), config.handshake_timeout)
+            except asyncio.TimeoutError:
+                await reject(reader, writer)
+                return
+            try:
+                await play(reader, writer)
+            finally:
+                slots.release()
+        finally:
+            admitted -= 1
+            games.discard(asyncio.current_task())
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in stop_signals:
+        try:
+            loop.add_signal_handler(signum, stop.set)
+        except NotImplementedError:  # Windows, stop on KeyboardInterrupt only
+            pass
+
+    server = await asyncio.start_server(on_connect, sock=tcp_sock, backlog=config.backlog)
+    async with server:
+        await stop.wait()
+        server.close()
+        if games:
+            logger.info("Waiting for %d running games to finish...", len(games))
+            await asyncio.wait(games, timeout=config.grace)
+        # Games still running after the grace period are cut off
+        for task in list(games):
+            task.cancel()
+        if games:
+            await asyncio.wait(games)
+    ticker.cancel()
@@ -0,0 +1,53 @@
+# Process-wide background writer threads: the log writer (gamelog), the game-history writer
+# (history), the leaderboard snapshots (leaderboard) and the session recorder (recording).
+# Each module keeps the object owning its thread in a Slot, and every slot is closed in one
+# place at exit, writing out what is still queued.
+# Threads do not survive a fork: a forked child keeping its parent's objects would queue to
+# threads that do not exist. Every forked child starts with empty slots, and a worker process
+# starts its own threads (see supervisor.worker_main).
+import atexit
+import os
+
+_slots = []
+
+
+class Slot:
+    """
+    The process's instance of one background service, an object whose close() writes out
+    what is queued and stops its thread. None while the service is off.
+    """
+    __slots__ = ("current",)
+
+    def __init__(self):
+        self.current = None
+        _slots.append(self)
+
+    def start(self, instance):
+        """
+        Make instance the current one, closing the previous one first.
+        """
+        self.stop()
+        self.current = instance
+
+    def stop(self):
+        instance, self.current = self.current, None
+        if instance is not None:
+            instance.close()
+
+
+def stop_all():
+    """
+    Close every service, the first slot created last: the log writer, which the other modules
+    import, still logs their errors.
+    """
+    for slot in reversed(_slots):
+        slot.stop()
+
+
+def _forget_all():
+    for slot in _slots:
+        slot.current = None
+
+
+atexit.register(stop_all)
+os.register_at_fork(after_in_child=_forget_all)
@@ -0,0 +1,59 @@
+# Microbenchmark of the per-message encode/decode cost.
+# Compares the old per-call format strings with the precompiled codecs in protocol.py.
+# Usage: python bench_protocol.py [iterations]
+import struct
+import sys
+import timeit
+import protocol
+from constants import *
+
+PAYLOAD_FORMAT = "!IBBHB"
+DECISION_FORMAT = "!IB5s"
+
+
+def bench(label, stmt, number, **names):
+    # Best of 5 runs, reported per message
+    best = min(timeit.repeat(stmt, number=number, repeat=5, globals=dict(globals(), **names)))
+    print(f"{label:<44} {best / number * 1e9:8.1f} ns/msg")
+
+
+def main(number=200_000):
+    names = dict(payload=protocol.pack_server_payload(ROUND_NOT_OVER, 12, 3),
+                 decision=protocol.HIT_PACKET,
+                 buffer=bytearray(PAYLOAD_LEN * 4),
+                 received=bytearray(10) + protocol.HIT_PACKET)
+
+    print(f"{number} iterations, best of 5\n")
+    print("Server payload encode")
+    bench("  struct.pack(format string)",
+          "struct.pack(PAYLOAD_FORMAT, MAGIC_COOKIE, PAYLOAD_TYPE, ROUND_NOT_OVER, 12, 3)", number, **names)
+    bench("  PAYLOAD.pack (precompiled)",
+          "protocol.PAYLOAD.pack(MAGIC_COOKIE, PAYLOAD_TYPE, ROUND_NOT_OVER, 12, 3)", number, **names)
+    bench("  pack_server_payload (52-card table)",
+          "protocol.pack_server_payload(ROUND_NOT_OVER, 12, 3)", number, **names)
+    bench("  struct.pack_into(format string)",
+          "struct.pack_into(PAYLOAD_FORMAT, buffer, 9, MAGIC_COOKIE, PAYLOAD_TYPE, ROUND_NOT_OVER, 12, 3)",
+          number, **names)
+    bench("  pack_server_payload_into (precompiled)",
+          "protocol.pack_server_payload_into(buffer, 9, ROUND_NOT_OVER, 12, 3)", number, **names)
+
+    print("\nServer payload decode")
+    bench("  struct.unpack(format string)", "struct.unpack(PAYLOAD_FORMAT, payload)", number, **names)
+    bench("  unpack_server_payload", "protocol.unpack_server_payload(payload)", number, **names)
+
+    print("\nClient decision encode")
+    bench("  struct.pack(format string)",
+          "struct.pack(DECISION_FORMAT, MAGIC_COOKIE, PAYLOAD_TYPE, b'Hittt')", number, **names)
+    bench("  pack_client_decision (prebuilt)", "protocol.pack_client_decision(b'Hittt')", number, **names)
+
+    print("\nClient decision decode")
+    bench("  struct.unpack(format string)", "struct.unpack(DECISION_FORMAT, decision)", number, **names)
+    bench("  unpack_client_payload", "protocol.unpack_client_payload(decision)", number, **names)
+    bench("  unpack + decode + str compare",
+          "protocol.unpack_client_payload(decision)[2].decode('utf-8') == 'Hittt'", number, **names)
+    bench("  raw match in the receive buffer",
+          "received.startswith(protocol.HIT_PACKET, 10)", number, **names)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200_000)
@@ -0,0 +1,173 @@
+# End-to-end throughput benchmark: starts a local server in each mode and runs many concurrent
+# bot sessions against it (client.play_bot), spread over a few processes of threads - or, with
+# --client async, over coroutines of client_core on one event loop per process.
+# Reports connections/sec, rounds/sec and p50/p99 per-decision latency for each mode.
+# Usage: python benchmark.py --sessions 2000 --rounds 20 --modes threaded async --workers 1 4
+import argparse
+import asyncio
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from array import array
+from multiprocessing import Pool
+from client import play_bot, play_bot_tables
+from client_core import BotPlayer, ConnectionPool, run_bots
+
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "server.py")
+THREAD_STACK_SIZE = 256 * 1024  # Thousands of bot threads, keep their stacks small
+
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(mode, workers, port, backlog, extra_args=()):
+    """
+    Start server.py in a subprocess and wait until it accepts connections.
+    It only logs warnings, to /dev/null, so logging does not slow it down.
+    """
+    cmd = [sys.executable, SERVER_SCRIPT, "--mode", mode, "--workers", str(workers),
+           "--port", str(port), "--backlog", str(backlog), "--grace", "1",
+           "--log-level", "WARNING", *extra_args]
+    proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return proc
+        except OSError:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError(f"Server ({mode}) did not start")
+
+
+def run_sessions(args):
+    """
+    Runs in a pool process: play `sessions` concurrent bot sessions, `games` games each.
+    :return: (games played, rounds played, errors, decision latencies in seconds)
+    """
+    port, sessions, games, rounds, stand_on, tables, pipeline, client, keep_alive = args
+    latencies = array("d")
+    if client == "async":
+        local = []
+
+        async def play():
+            pool = ConnectionPool("127.0.0.1", port) if keep_alive else None
+            try:
+                return await run_bots("127.0.0.1", port, sessions, games, rounds, "Bench",
+                                      lambda: BotPlayer(stand_on, pipeline=pipeline), local, pool)
+            finally:
+                if pool is not None:
+                    await pool.close()
+
+        wins, ties, losses, errors = asyncio.run(play())
+        latencies.extend(local)
+        return sessions * games - errors, wins + ties + losses, errors, latencies
+
+    threading.stack_size(THREAD_STACK_SIZE)
+    counts = [0, 0, 0]  # games, rounds, errors
+    lock = threading.Lock()
+
+    def session():
+        local = []
+        done = [0, 0, 0]
+        for _ in range(games):
+            try:
+                if tables > 1:
+                    play_bot_tables("127.0.0.1", port, rounds, tables, "Bench", stand_on, local,
+                                    pipeline=pipeline)
+                else:
+                    play_bot("127.0.0.1", port, rounds, "Bench", stand_on, local, pipeline=pipeline)
+                done[0] += 1
+                done[1] += rounds * tables
+            except (OSError, ConnectionError):
+                done[2] += 1
+        with lock:
+            latencies.extend(local)
+            for i in range(3):
+                counts[i] += done[i]
+
+    threads = [threading.Thread(target=session) for _ in range(sessions)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return counts[0], counts[1], counts[2], latencies
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return float("nan")
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p))]
+
+
+def bench(mode, workers, sessions, procs, games, rounds, stand_on, backlog, tables=1, pipeline=False,
+          client="threads", keep_alive=False):
+    port = free_port()
+    server = start_server(mode, workers, port, backlog)
+    try:
+        share = [(port, sessions // procs + (i < sessions % procs), games, rounds, stand_on, tables,
+                  pipeline, client, keep_alive) for i in range(procs)]
+        start = time.perf_counter()
+        with Pool(procs) as pool:
+            parts = pool.map(run_sessions, share)
+        elapsed = time.perf_counter() - start
+    finally:
+        server.send_signal(signal.SIGTERM)
+        try:
+            server.wait(10)
+        except subprocess.TimeoutExpired:
+            server.kill()
+
+    played = sum(part[0] for part in parts)
+    rounds_played = sum(part[1] for part in parts)
+    errors = sum(part[2] for part in parts)
+    latencies = sorted(value for part in parts for value in part[3])
+    return {
+        "mode": f"{mode} x{workers}",
+        "connections_per_sec": played / elapsed,
+        "rounds_per_sec": rounds_played / elapsed,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "errors": errors,
+        "seconds": elapsed,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="End-to-end server throughput benchmark")
+    parser.add_argument("--modes", nargs="+", choices=["threaded", "async"], default=["threaded", "async"])
+    parser.add_argument("--workers", nargs="+", type=int, default=[1], help="server worker counts to run")
+    parser.add_argument("--sessions", type=int, default=1000, help="concurrent bot sessions")
+    parser.add_argument("--procs", type=int, default=os.cpu_count() or 1, help="client processes")
+    parser.add_argument("--games", type=int, default=1, help="games per session")
+    parser.add_argument("--rounds", type=int, default=10, help="rounds per game")
+    parser.add_argument("--stand-on", type=int, default=17)
+    parser.add_argument("--backlog", type=int, default=4096)
+    parser.add_argument("--tables", type=int, default=1, help="tables per connection (multi-table sessions)")
+    parser.add_argument("--pipeline", action="store_true", help="bots send one decision plan per round")
+    parser.add_argument("--client", choices=["threads", "async"], default="threads",
+                        help="bot sessions as threads (client.play_bot) or coroutines (client_core)")
+    parser.add_argument("--keep-alive", action="store_true",
+                        help="sessions play their games over one kept-alive connection (--client async)")
+    args = parser.parse_args()
+    if args.client == "async" and args.tables > 1:
+        parser.error("--client async plays single-table sessions")
+    if args.keep_alive and args.client != "async":
+        parser.error("--keep-alive needs --client async")
+
+    print(f"{args.sessions} sessions x {args.games} games x {args.tables} tables x {args.rounds} rounds, "
+          f"{args.procs} client processes\n")
+    print(f"{'mode':<14}{'conn/s':>10}{'rounds/s':>12}{'p50 ms':>10}{'p99 ms':>10}{'errors':>8}")
+    for workers in args.workers:
+        for mode in args.modes:
+            r = bench(mode, workers, args.sessions, args.procs, args.games, args.rounds,
+                      args.stand_on, args.backlog, args.tables, args.pipeline, args.client, args.keep_alive)
+            print(f"{r['mode']:<14}{r['connections_per_sec']:>10.1f}{r['rounds_per_sec']:>12.1f}"
+                  f"{r['p50_ms']:>10.2f}{r['p99_ms']:>10.2f}{r['errors']:>8}")
@@ -0,0 +1,178 @@
+# Compact card representation and the deck engine used in the game loop.
+# A card is a small int: (rank - 1) * 4 + suit, with rank 1-13 (Ace to King) and suit 0-3,
+# which is also its index in the protocol's payload tables. Decks are bytearrays of cards.
+import random
+import threading
+from constants import LOSS, TIE, WIN, get_suit_char
+
+DECK_SIZE = 52
+# Game rules, shared by the server and the simulator
+BLACKJACK = 21
+DEALER_STANDS_ON = 17  # The dealer hits while below this total
+# A shoe with penetration is reshuffled before a round once fewer cards than this remain,
+# so a round never runs out of cards
+ROUND_RESERVE = 26
+# Every card of one deck, in order
+FULL_DECK = bytes(range(DECK_SIZE))
+
+# Lookup tables indexed by card
+RANKS = bytes(card // 4 + 1 for card in range(DECK_SIZE))
+SUITS = bytes(card % 4 for card in range(DECK_SIZE))
+# Ace counts 11 (reduced to 1 by Hand when needed), Face cards are 10
+VALUES = bytes(11 if rank == 1 else min(rank, 10) for rank in RANKS)
+
+RANK_NAMES = {1: 'Ace', 11: 'Jack', 12: 'Queen', 13: 'King'}
+
+
+class Card:
+    """
+    Read-only view of a card int, used only for logging.
+    """
+    __slots__ = ("card",)
+
+    def __init__(self, card):
+        self.card = card
+
+    def __str__(self):
+        rank = RANKS[self.card]
+        return f"{RANK_NAMES.get(rank, str(rank))} of {get_suit_char(SUITS[self.card])}"
+
+
+# CARDS[card] -> its Card view, so log calls pass a card without creating an object
+CARDS = tuple(Card(card) for card in range(DECK_SIZE))
+
+
+class Hand:
+    """
+    Cards of one player, with the hand value kept up to date as each card is added.
+    total is the best value of the hand, soft is the number of aces still counted as 11.
+    """
+    __slots__ = ("cards", "total", "soft")
+
+    def __init__(self, *cards):
+        self.cards = bytearray()
+        self.total = 0
+        self.soft = 0
+        for card in cards:
+            self.add(card)
+
+    def add(self, card):
+        self.cards.append(card)
+        value = VALUES[card]
+        if value == 11:
+            self.soft += 1
+        total = self.total + value
+        # Adjust for aces if bust
+        while total > BLACKJACK and self.soft:
+            total -= 10
+            self.soft -= 1
+        self.total = total
+        return total
+
+    def __len__(self):
+        return len(self.cards)
+
+    def __str__(self):
+        return ", ".join(str(Card(card)) for card in self.cards)
+
+
+def settle(player_total, dealer_total):
+    """
+    Result of a round in which the player did not bust.
+    :return: WIN, TIE or LOSS
+    """
+    if dealer_total > BLACKJACK:  # Dealer bust
+        return WIN
+    if player_total > dealer_total:
+        return WIN
+    if player_total == dealer_total:
+        return TIE
+    return LOSS
+
+
+class Shoe:
+    """
+    One or more decks dealt from a single reusable buffer.
+    Every shoe has its own seeded random generator, so connections do not share the global
+    random state and a game can be replayed from its seed. Without penetration the shoe is
+    reshuffled before every round, like a fresh deck. With penetration (the fraction of the
+    shoe dealt before the cut card) rounds keep dealing from the same shuffle.
+    """
+    __slots__ = ("cards", "remaining", "reshuffle_at", "seed", "rng", "shuffles")
+
+    def __init__(self, decks=1, penetration=None, seed=None, shuffles=None):
+        """
+        :param decks: Number of 52-card decks in the shoe
+        :param penetration: Fraction of the shoe dealt before reshuffling (None to reshuffle every round)
+        :param seed: Seed of the shoe's random generator (None for a random seed)
+        :param shuffles: Optional PregeneratedShuffles to take shoe orders from instead of shuffling
+        """
+        self.cards = bytearray(FULL_DECK * decks)
+        size = len(self.cards)
+        if penetration is None:
+            self.reshuffle_at = size
+        else:
+            self.reshuffle_at = max(size - int(size * penetration), ROUND_RESERVE)
+        self.seed = random.getrandbits(64) if seed is None else seed
+        self.rng = random.Random(self.seed)
+        self.shuffles = shuffles
+        self.remaining = 0
+
+    def shuffle(self):
+        if self.shuffles is not None:
+            self.shuffles.fill(self.cards)
+        else:
+            self.rng.shuffle(self.cards)
+        self.remaining = len(self.cards)
+
+    def start_round(self):
+        """
+        Reshuffle if the cut card was reached.
+        """
+        if self.remaining <= self.reshuffle_at:
+            self.shuffle()
+
+    def draw(self):
+        if not self.remaining:
+            # Only reached when a shoe has no reserve left for the round
+            self.shuffle()
+        self.remaining -= 1
+        return self.cards[self.remaining]
+
+
+class PregeneratedShuffles:
+    """
+    Shoe orders shuffled in bulk with NumPy: a whole batch of shoes is permuted in one
+    vectorized call, and shoes copy their next order from it instead of shuffling.
+    Safe to share between threads.
+    """
+
+    def __init__(self, decks=1, batch=1024, seed=None):
+        # Imported here: NumPy is only needed for bulk pre-generated shuffles, and importing
+        # it would double the startup time of the clients
+        try:
+            import numpy as np
+        except ImportError:
+            raise RuntimeError("Pre-generated shuffles require NumPy") from None
+        self.rng = np.random.default_rng(seed)
+        # One unshuffled shoe per row
+        self.ordered = np.tile(np.arange(DECK_SIZE, dtype=np.uint8), (batch, decks))
+        self.batch = self.ordered
+        self.next_row = batch
+        self.lock = threading.Lock()
+
+    def generate(self):
+        # Shuffles every row independently
+        self.batch = self.rng.permuted(self.ordered, axis=1)
+        self.next_row = 0
+
+    def fill(self, cards):
+        """
+        Copy the next shuffled shoe order into a shoe's buffer.
+        """
+        with self.lock:
+            if self.next_row == len(self.batch):
+                self.generate()
+            row = self.batch[self.next_row]
+            self.next_row += 1
+        memoryview(cards)[:] = row
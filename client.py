@@ -1,27 +1,20 @@
+import argparse
+import asyncio
+import os
 import socket
-import struct
+import sys
+import threading
+import time
+import strategy
+from client_core import (PLAYER, BotPlayer, ConnectionPool, calculate_hand, play_game, plan_totals, run_bots,
+                         wants_hit)
 from constants import *
+from discovery import Discovery
+from framing import MessageReader
+from protocol import (is_rejection, pack_client_decision, pack_plan, pack_request, pack_table_decision,
+                      pack_table_plan, pack_tables_request, unpack_server_payload, unpack_table_payload)
 
 
-def pack_client_decision(decision):
-    """
-    Client -> Server (10 bytes): Cookie(4), Type(1), Decision(5)
-    """
-    # Decision must be 5 bytes: "Hittt" or "Stand"
-    return struct.pack("!IB5s", MAGIC_COOKIE, PAYLOAD_TYPE, decision)
-
-
-def unpack_server_payload(data):
-    """
-    Server -> Client (9 bytes): Cookie(4), Type(1), Result(1), Rank(2), Suit(1)
-    """
-    if not data or len(data) < 9: return None
-    try:
-        cookie, mtype, result, rank, suit = struct.unpack("!IBBHB", data)
-        return result, rank, suit
-    except struct.error:
-        return None
-
 # def get_suit_char(suit_int):
 #     return ["Heart", "Diamond", "Clubs", "Spades"][suit_int]
 
@@ -32,201 +25,145 @@ def get_rank_str(rank_int):
     if rank_int == 13: return "King"
     return str(rank_int)
 
-def calculate_hand(cards):
+def print_hand(cards, owner):
+    return f"\n{owner} Hand: " + ", ".join(f"{get_rank_str(card[0])} of {get_suit_char(card[1])}" for card in cards)
+
+def print_total(cards):
+    hand, ace = calculate_hand(cards)
+    if ace == 0:
+        print(f"Your hand total: {hand}\n")
+    else:
+        print(f"Your hand total is: {hand} or {hand - 10}\n")
+
+def read_line(prompt):
     """
-    Calculate the total value of a hand based on card ranks.
-    :param cards: list of card ranks (integers)
-    :return: total value of the hand (integer)
+    input() without Python's stdin buffer: the line is read from the file descriptor a byte at
+    a time, so a thread blocked here holds no lock the interpreter needs to exit, and nothing
+    is read ahead of the line.
     """
-    total = 0
-    aces = 0
-    for card in cards:
-        if card[0] == 1:
-            aces += 1
-            total += 11  # Ace
-        elif card[0] >= 11:
-            total += 10  # J, Q, K
-        else:
-            total += card[0]  # 2-10
-
-    while total > 21 and aces > 0:
-        total -= 10
-        aces -= 1
+    print(prompt, end="", flush=True)
+    line = bytearray()
+    while not line.endswith(b"\n"):
+        byte = os.read(sys.stdin.fileno(), 1)
+        if not byte:
+            if not line:
+                raise EOFError
+            break
+        line += byte
+    return line.decode(sys.stdin.encoding or "utf-8", "replace").rstrip("\r\n")
 
-    return total, aces
 
-def print_hand(cards, owner):
-    return f"\n{owner} Hand: " + ", ".join(f"{get_rank_str(card[0])} of {get_suit_char(card[1])}" for card in cards)
+async def ask(prompt):
+    """
+    read_line() on a daemon thread, so the event loop keeps running while the user thinks.
+    Not the loop's executor: on Ctrl-C, asyncio.run() would wait for the line before exiting,
+    the daemon thread is simply left behind.
+    """
+    loop = asyncio.get_running_loop()
+    answer = loop.create_future()
 
-def client_main():
-    team_name = "Team omer"
+    def settle(set_answer, value):
+        if not answer.done():  # Cancelled when the game was interrupted
+            set_answer(value)
 
-    while True:
-        # Enable reuse port for testing multiple clients on same machine
-        udp_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    def read():
         try:
-            udp_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
-        except AttributeError:
-            # Some OS (like Windows) don't support SO_REUSEPORT, use SO_REUSEADDR
-            udp_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-
-        udp_sock.bind(("", UDP_PORT))
+            outcome = (answer.set_result, read_line(prompt))
+        except Exception as e:  # EOFError, raised to the caller
+            outcome = (answer.set_exception, e)
         try:
+            loop.call_soon_threadsafe(settle, *outcome)
+        except RuntimeError:
+            pass  # The loop is closed
 
-            print("Client started, listening for offer requests...")
-            # Wait for Offer
-            data, addr = udp_sock.recvfrom(1024)
-            # Offer: Cookie(4), Type(1), Port(2), Name(32) = 39 bytes
-            if len(data) < 39: continue
+    threading.Thread(target=read, daemon=True).start()
+    return await answer
 
-            cookie, mtype, server_port, server_name = struct.unpack("!IBH32s", data[:39])
-            if cookie != MAGIC_COOKIE or mtype != OFFER_TYPE:
-                continue
 
-            s_name = server_name.decode('utf-8').strip('\x00')
-            print(f"Received offer from {server_name} at {addr[0]}, attempting to connect...")
+class ConsolePlayer:
+    """
+    Interactive frontend of client_core: prints the game as it is dealt and asks the user
+    for each decision.
+    """
 
-            # Connect TCP
-            tcp_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            tcp_sock.connect((addr[0], server_port))
+    def card(self, round, owner, rank, suit):
+        card = f"{get_rank_str(rank)} of {get_suit_char(suit)}"
+        if owner == PLAYER:
+            if len(round.player) == 1:
+                print(f"\n{Colors.GREEN}--- Round {round.number} ---{Colors.RESET}")
+            if len(round.player) <= 2:
+                print(f"Your card: {card}")
+            else:
+                print(f"You drew: {card}")
+            if len(round.player) >= 2:
+                print_total(round.player)
+        elif len(round.dealer) == 1:
+            print(f"Dealer first card: {card}")
+            print(f"Dealer second card is hidden.\n{'-'*30}\n")
+        elif len(round.dealer) == 2:
+            print(f"Dealer reveals hidden card: {card}")
+        else:
+            print(f"Dealer draw: {card}")
+
+    async def decide(self, round):
+        if round.total == 21:
+            if len(round.player) == 2:
+                print("Blackjack! You have 21.")
+            return False
+
+        choice = ''
+        while choice not in ['s', 'h']:
+            choice = (await ask("Type 'h' to Hit, 's' to Stand: ")).lower()
+        return choice == 'h'
+
+    def result(self, round):
+        hand = round.total
+        dealer_total = calculate_hand(round.dealer)[0]
+        if round.result == LOSS:
+            if hand > 21:
+                print("You Busted!")
+            else:
+                print(print_hand(round.dealer, "Dealer"))
+                print(f"Dealer have total value of {dealer_total}")
+                print(f"Your hand total: {hand}\n")
+                print("You Lost!")
+        elif round.result == WIN:
+            print(print_hand(round.dealer, "Dealer"))
+            print(f"Dealer have total value of {dealer_total}\n")
+            print("You Won!")
+        elif round.result == TIE:
+            print(print_hand(round.dealer, "Dealer"))
+            print(f"Dealer have total value of {dealer_total}\n")
+            print("Tie!")
+        print(f"{Colors.CYAN}Round over.{Colors.RESET}\n")
 
-            # 3. Send Request
-            # Ask user for rounds
+
+def client_main():
+    team_name = "Team omer"
+    # Kept open between games, so the next game can start from a cached offer
+    discovery = Discovery()
+    player = ConsolePlayer()
+
+    while True:
+        try:
+            print("Client started, listening for offer requests...")
+            offer = discovery.find()
+            print(f"Received offer from {offer.name} at {offer.addr}")
+
+            # Ask before connecting, the server only waits HANDSHAKE_TIMEOUT for the request
             rounds = 0
-            while rounds < 1:
+            while not 1 <= rounds <= 255:
                 try:
-                    rounds = int(input("How many rounds you want to play? "))
+                    rounds = int(read_line("How many rounds you want to play? "))
                 except ValueError:
                     print("Invalid input, please enter a number.")
 
-            # Request: Cookie(4), Type(1), Rounds(1), Name(32)
-            name_bytes = team_name.encode('utf-8') + b'\x00' * (32 - len(team_name))
-            req_pkt = struct.pack("!IBB32s", MAGIC_COOKIE, REQUEST_TYPE, rounds, name_bytes)
-            tcp_sock.sendall(req_pkt)
-
-            wins=0
-            ties=0
-
-            # --- Game Loop ---
-            for r in range(rounds):
-                print(f"\n{Colors.GREEN}{f"--- Round {r + 1} ---"}{Colors.RESET}")
-
-                player_cards = []
-                dealer_cards = []
-
-                # Receive initial cards (Player 1, Player 2, Dealer 1)
-                # We expect 3 packets of 9 bytes each
-                for _ in range(2):
-                    data = tcp_sock.recv(9)
-                    package = unpack_server_payload(data)
-                    if not package:
-                        raise ConnectionError("Failed to receive initial player cards.")
-                    res, rank, suit = package
-                    print(f"Your card: {get_rank_str(rank)} of {get_suit_char(suit)}")
-                    player_cards.append((rank, suit))
-
-                hand, ace = calculate_hand(player_cards)
-                if ace == 0:
-                    print(f"Your hand total: {hand}\n")
-                else:
-                    print(f"Your hand total is: {hand} or {hand - 10}\n")
-
-                data = tcp_sock.recv(9)
-                package = unpack_server_payload(data)
-                if not package:
-                    raise ConnectionError("Failed to receive initial dealer card.")
-                res, rank, suit = package
-                print(f"Dealer first card: {get_rank_str(rank)} of {get_suit_char(suit)}")
-                print(f"Dealer second card is hidden.\n{'-'*30}\n")
-                dealer_cards.append((rank, suit))
-
-                # Player turn
-                game_over = False
-                while not game_over:
-                    # Check if server already sent "Loss" (e.g. from previous hit busting)
-                    if res != 0:
-                        game_over = True
-                        break
-
-                    hand, _ = calculate_hand(player_cards)
-                    if hand == 21:
-                        if len(player_cards) == 2:
-                            print("Blackjack! You have 21.")
-                        tcp_sock.sendall(pack_client_decision(b"Stand"))
-                        break
-
-                    choice = ''
-                    while choice not in ['s', 'h']:
-                        choice = input("Type 'h' to Hit, 's' to Stand: ").lower()
-
-                    if choice == 'h':
-                        tcp_sock.sendall(pack_client_decision(b"Hittt"))
-
-                        # Get response (Card or Result)
-                        data = tcp_sock.recv(9)
-                        package = unpack_server_payload(data)
-                        if not package:
-                            raise ConnectionError("Failed to receive card after Hit.")
-                        res, rank, suit = package
-
-                        if rank != 0:
-                            player_cards.append((rank, suit))
-                            print(f"You drew: {get_rank_str(rank)} of {get_suit_char(suit)}")
-                            hand, ace = calculate_hand(player_cards)
-                            if ace == 0:
-                                print(f"Your hand total: {hand}\n")
-                            else:
-                                print(f"Your hand total is: {hand} or {hand - 10}\n")
-                            if hand > 21:
-                                game_over = True
-
-
-                    elif choice == 's':
-                        tcp_sock.sendall(pack_client_decision(b"Stand"))
-                        break  # Exit user input loop, wait for dealer
-
-
-                # Wait for Dealer sequence and final result
-                while True:
-                    if not game_over:
-                        data = tcp_sock.recv(9)
-                        package = unpack_server_payload(data)
-                        if not package:
-                            raise ConnectionError("Failed to receive dealer card/result.")
-                        res, rank, suit = package
-
-                    if res != ROUND_NOT_OVER:  # Game ended (Win/Loss/Tie)
-                        if res == LOSS:
-                            hand, ace = calculate_hand(player_cards)
-                            if hand > 21:
-                                print("You Busted!")
-                            else:
-                                print(print_hand(dealer_cards, "Dealer"))
-                                print(f"Dealer have total value of {calculate_hand(dealer_cards)[0]}")
-                                print(f"Your hand total: {hand}\n")
-                                print("You Lost!")
-                        elif res == WIN:
-                            wins+=1
-                            print(print_hand(dealer_cards, "Dealer"))
-                            print(f"Dealer have total value of {calculate_hand(dealer_cards)[0]}\n")
-                            print("You Won!")
-
-                        elif res == TIE:
-                            ties+=1
-                            print(print_hand(dealer_cards, "Dealer"))
-                            print(f"Dealer have total value of {calculate_hand(dealer_cards)[0]}\n")
-                            print("Tie!")
-
-                        print(f"{Colors.CYAN}Round over.{Colors.RESET}\n")
-                        break
-                    else:
-                        # Dealer drew a card
-                        if len(dealer_cards) == 1:
-                            print(f"Dealer reveals hidden card: {get_rank_str(rank)} of {get_suit_char(suit)}")
-                        else:
-                            print(f"Dealer draw: {get_rank_str(rank)} of {get_suit_char(suit)}")
-
-                        dealer_cards.append((rank, suit))
+            print(f"Connecting to {offer.addr}:{offer.port}...")
+            try:
+                wins, ties, losses = asyncio.run(play_game(offer.addr, offer.port, rounds, team_name, player))
+            except OSError:
+                discovery.forget(offer)
+                raise
 
             if wins == rounds:
                 print(f"Congratulations! You won all {rounds} rounds!")
@@ -236,19 +173,255 @@ def client_main():
                 print(f"Finished playing {rounds} rounds, win rate: {(wins/rounds)*100}%")
 
             print("All rounds finished. Disconnecting.\n")
-            print("You Won ")
-
-            tcp_sock.close()
             # Loop back to UDP listening
 
-
-        except KeyboardInterrupt:
+        except (KeyboardInterrupt, EOFError):
             print("Client shutting down.")
+            discovery.close()
             break
         except Exception as e:
             print(f"An error occurred: {e}")
-            if 'tcp_sock' in locals():
-                tcp_sock.close()
+
+def play_bot(server_addr, server_port, rounds, team_name="Bot", stand_on=17, latencies=None, basic=None,
+             pipeline=False):
+    """
+    Play one game without user input: hit while the hand total is below stand_on, then stand.
+    :param rounds: Number of rounds (1-255)
+    :param basic: strategy.StrategyTables to play basic strategy instead of stand_on
+    :param pipeline: Send the strategy as a decision plan once per round, so a round takes one
+                     round trip whatever the number of hits
+    :param latencies: Optional list that collects the seconds between each decision and the
+                      first payload the server sends back for it
+    :return: (wins, ties, losses)
+    """
+    results = {WIN: 0, TIE: 0, LOSS: 0}
+    tcp_sock = socket.create_connection((server_addr, server_port))
+    try:
+        tcp_sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        reader = MessageReader(tcp_sock)
+        tcp_sock.sendall(pack_request(rounds, team_name))
+
+        def receive():
+            # Unpacked in place from the reader's buffer
+            offset = reader.read_offset(PAYLOAD_LEN)
+            package = unpack_server_payload(reader.buffer, offset) if offset >= 0 else None
+            if not package:
+                raise ConnectionError("Connection lost.")
+            if package[0] == BUSY:
+                raise ConnectionError("Server is full.")
+            return package
+
+        def decide(packet):
+            sent = time.perf_counter()
+            tcp_sock.sendall(packet)
+            package = receive()
+            if latencies is not None:
+                latencies.append(time.perf_counter() - sent)
+            return package
+
+        for _ in range(rounds):
+            # Player 1, Player 2, Dealer 1
+            player_cards = [receive()[1:], receive()[1:]]
+            dealer_rank = receive()[1]
+
+            res = ROUND_NOT_OVER
+            if pipeline:
+                # The server plays the turn: the hits, the dealer's cards and the result follow
+                res = decide(pack_plan(*plan_totals(dealer_rank, stand_on, basic)))[0]
+            else:
+                while wants_hit(player_cards, dealer_rank, stand_on, basic):
+                    res, rank, suit = decide(pack_client_decision(b"Hittt"))
+                    player_cards.append((rank, suit))
+                    if res != ROUND_NOT_OVER:  # Busted
+                        break
+                if res == ROUND_NOT_OVER:
+                    res = decide(pack_client_decision(b"Stand"))[0]
+
+            # Dealer's cards until the result arrives
+            while res == ROUND_NOT_OVER:
+                res = receive()[0]
+            results[res] += 1
+    finally:
+        tcp_sock.close()
+    return results[WIN], results[TIE], results[LOSS]
+
+
+class BotTable:
+    """
+    State of one table of a multi-table bot session.
+    """
+    __slots__ = ("cards", "dealer", "dealt", "standing", "waiting", "rounds", "sent")
+
+    def __init__(self):
+        self.cards = []     # Player's cards of the current round
+        self.dealer = 0     # Rank of the dealer's upcard
+        self.dealt = 0      # Cards of the initial deal received so far (player 2, dealer 1)
+        self.standing = False  # Stood this round, the dealer's cards are coming
+        self.waiting = False   # A decision was sent and its first payload has not arrived yet
+        self.rounds = 0
+        self.sent = 0.0
+
+
+def play_bot_tables(server_addr, server_port, rounds, tables, team_name="Bot", stand_on=17, latencies=None,
+                    basic=None, pipeline=False):
+    """
+    Play several games at once over one connection (a multi-table session), with the same
+    strategy as play_bot. Payloads are handled in the order they arrive, whatever their table,
+    so the server always has decisions to work on.
+    :param tables: Number of tables (1-64)
+    :param rounds: Rounds per table
+    :return: (wins, ties, losses) over all tables
+    """
+    results = {WIN: 0, TIE: 0, LOSS: 0}
+    state = [BotTable() for _ in range(tables)]
+    playing = tables if rounds else 0
+    tcp_sock = socket.create_connection((server_addr, server_port))
+    try:
+        tcp_sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        reader = MessageReader(tcp_sock)
+        tcp_sock.sendall(pack_tables_request(rounds, tables, team_name))
+        # A full server answers with a 9-byte BUSY payload instead of the table payloads
+        head = reader.peek(PAYLOAD_LEN)
+        if head is not None and is_rejection(head):
+            raise ConnectionError("Server is full.")
+
+        def decide(table, t):
+            if pipeline:
+                # The rest of the round's cards come without further decisions
+                packet = pack_table_plan(table, *plan_totals(t.dealer, stand_on, basic))
+                t.standing = True
+            else:
+                decision = b"Hittt" if wants_hit(t.cards, t.dealer, stand_on, basic) else b"Stand"
+                packet = pack_table_decision(table, decision)
+                t.standing = decision == b"Stand"
+            t.waiting = True
+            t.sent = time.perf_counter()
+            tcp_sock.sendall(packet)
+
+        while playing:
+            offset = reader.read_offset(TABLE_PAYLOAD_LEN)
+            package = unpack_table_payload(reader.buffer, offset) if offset >= 0 else None
+            if not package:
+                raise ConnectionError("Connection lost.")
+            table, res, rank, suit = package
+            t = state[table]
+            if t.waiting:
+                t.waiting = False
+                if latencies is not None:
+                    latencies.append(time.perf_counter() - t.sent)
+
+            if t.dealt < 3:
+                # Player 1, Player 2, Dealer 1
+                t.dealt += 1
+                if t.dealt < 3:
+                    t.cards.append((rank, suit))
+                else:
+                    t.dealer = rank
+                    decide(table, t)
+            elif res != ROUND_NOT_OVER:
+                # Bust or the result after standing, the next round's deal follows
+                results[res] += 1
+                t.rounds += 1
+                t.cards = []
+                t.dealt = 0
+                t.standing = False
+                if t.rounds == rounds:
+                    playing -= 1
+            elif not t.standing:
+                # The card of a hit
+                t.cards.append((rank, suit))
+                decide(table, t)
+            # Otherwise one of the dealer's cards, wait for the result
+    finally:
+        tcp_sock.close()
+    return results[WIN], results[TIE], results[LOSS]
+
+
+def bot_main(connect, rounds, games, team_name, stand_on, tables=1, basic=False, pipeline=False, sessions=1,
+             keep_alive=False):
+    """
+    Bot mode: play games back to back, with the server from connect ("host:port") or from
+    the next UDP offer.
+    :param games: Number of games to play, 0 to play forever
+    :param tables: Tables per connection, more than 1 plays a multi-table session
+    :param basic: Play basic strategy instead of standing on stand_on
+    :param pipeline: Send one decision plan per round instead of each decision
+    :param sessions: Sessions playing each game concurrently, all on this process's event loop
+    :param keep_alive: Play the next games over the same connections while they are warm,
+                       without waiting for an offer again (single-table games)
+    """
+    basic = strategy.tables() if basic else None
+    make_player = lambda: BotPlayer(stand_on, basic, pipeline)
+    played = 0
+    discovery = None if connect else Discovery()
+    # One loop for every game: pooled connections belong to the loop that opened them
+    loop = asyncio.new_event_loop()
+    pool = None
+    while not games or played < games:
+        offer = None
+        if connect:
+            server_addr, server_port = connect.rsplit(":", 1)
+            server_port = int(server_port)
+        elif pool is not None and pool.warm:
+            # The last game's server still holds a connection for us
+            server_addr, server_port = pool.host, pool.port
+        else:
+            print("Bot started, listening for offer requests...")
+            offer = discovery.find()
+            server_addr, server_port = offer.addr, offer.port
+        if keep_alive and tables == 1 and (pool is None or (pool.host, pool.port) != (server_addr, server_port)):
+            if pool is not None:
+                loop.run_until_complete(pool.close())
+            pool = ConnectionPool(server_addr, server_port)
+        try:
+            if tables > 1:
+                wins, ties, losses = play_bot_tables(server_addr, server_port, rounds, tables, team_name, stand_on,
+                                                     basic=basic, pipeline=pipeline)
+            elif sessions > 1:
+                wins, ties, losses, errors = loop.run_until_complete(run_bots(
+                    server_addr, server_port, sessions, 1, rounds, team_name, make_player, pool=pool))
+                if errors == sessions:
+                    raise ConnectionError(f"All {sessions} sessions failed.")
+                if errors:
+                    print(f"{errors} of {sessions} sessions failed.")
+            else:
+                wins, ties, losses = loop.run_until_complete(play_game(server_addr, server_port, rounds, team_name,
+                                                                       make_player(), pool=pool))
+            print(f"Game {played + 1}: {wins} wins, {ties} ties, {losses} losses out of "
+                  f"{wins + ties + losses} rounds")
+        except (OSError, ConnectionError) as e:
+            print(f"An error occurred: {e}")
+            if offer is not None:
+                discovery.forget(offer)
+        played += 1
+    if pool is not None:
+        loop.run_until_complete(pool.close())
+        print(f"{pool.opened} connections for {played} games.")
+    loop.close()
+    if discovery is not None:
+        discovery.close()
+
 
 if __name__ == "__main__":
-    client_main()
+    parser = argparse.ArgumentParser(description="Blackjack client")
+    parser.add_argument("--bot", action="store_true", help="play automatically instead of asking for input")
+    parser.add_argument("--connect", metavar="HOST:PORT", help="bot: connect directly, skipping UDP offers")
+    parser.add_argument("--rounds", type=int, default=10, help="bot: rounds per game")
+    parser.add_argument("--games", type=int, default=1, help="bot: games to play, 0 for no limit")
+    parser.add_argument("--stand-on", type=int, default=17, help="bot: stand once the hand reaches this total")
+    parser.add_argument("--basic", action="store_true", help="bot: play basic strategy instead of --stand-on")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="bot: let the server play each turn from a decision plan, one round trip per round")
+    parser.add_argument("--team", default="Bot", help="bot: team name")
+    parser.add_argument("--tables", type=int, default=1, help="bot: tables played at once over one connection")
+    parser.add_argument("--sessions", type=int, default=1,
+                        help="bot: connections playing each game at once, from a single thread")
+    parser.add_argument("--keep-alive", action="store_true",
+                        help="bot: play the next game over the same connection instead of a new one")
+    args = parser.parse_args()
+
+    if args.bot:
+        bot_main(args.connect, args.rounds, args.games, args.team, args.stand_on, args.tables, args.basic,
+                 args.pipeline, args.sessions, args.keep_alive)
+    else:
+        client_main()
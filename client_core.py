@@ -0,0 +1,293 @@
+# Event-driven client core: plays games as asyncio coroutines, so one process can run hundreds
+# of sessions at once on a single thread. The core only speaks the protocol and keeps the round
+# state; what to do with it - print it, ask the user, or decide right away - is up to a player
+# object (the bots below, or the console frontend in client.py). Nothing is formatted here.
+# Games played back to back can share warm connections through a ConnectionPool: the requests
+# then ask the server to keep the connection alive (see constants.KEEP_ALIVE).
+import asyncio
+import inspect
+import socket
+import time
+from constants import *
+from protocol import HIT_PACKET, STAND_PACKET, pack_plan, pack_request, unpack_server_payload
+
+PLAYER = "player"
+DEALER = "dealer"
+POOL_IDLE = 10.0  # Seconds a pooled connection is reused for, well within the server's idle timeout
+
+
+def calculate_hand(cards):
+    """
+    Calculate the total value of a hand based on card ranks.
+    :param cards: list of (rank, suit) tuples
+    :return: (total value of the hand, aces still counted as 11)
+    """
+    total = 0
+    aces = 0
+    for card in cards:
+        if card[0] == 1:
+            aces += 1
+            total += 11  # Ace
+        elif card[0] >= 11:
+            total += 10  # J, Q, K
+        else:
+            total += card[0]  # 2-10
+
+    while total > 21 and aces > 0:
+        total -= 10
+        aces -= 1
+
+    return total, aces
+
+
+def upcard_value(rank):
+    """
+    :return: Value of the dealer's upcard as the strategy tables index it (2-10, Ace is 11)
+    """
+    return 11 if rank == 1 else min(rank, 10)
+
+
+def wants_hit(cards, dealer_rank, stand_on, basic=None):
+    """
+    Bot decision: basic strategy when given its tables, otherwise hit while below stand_on.
+    :param basic: strategy.StrategyTables, or None
+    """
+    total, aces = calculate_hand(cards)
+    if basic is not None:
+        return basic.should_hit(total, aces > 0, upcard_value(dealer_rank))
+    return total < stand_on
+
+
+def plan_totals(dealer_rank, stand_on, basic=None):
+    """
+    The bot's strategy as a decision plan for the server to play (see protocol.pack_plan).
+    :return: (hard, soft) stand totals
+    """
+    if basic is not None:
+        return basic.stand_totals(upcard_value(dealer_rank))
+    return stand_on, stand_on
+
+
+class Round:
+    """
+    State of the round being played, as the client sees it.
+    """
+    __slots__ = ("number", "player", "dealer", "result")
+
+    def __init__(self, number):
+        self.number = number
+        self.player = []  # (rank, suit) of the player's cards
+        self.dealer = []  # (rank, suit) of the dealer's cards seen so far
+        self.result = ROUND_NOT_OVER
+
+    @property
+    def total(self):
+        return calculate_hand(self.player)[0]
+
+
+class BotPlayer:
+    """
+    Player that decides without input: stands on stand_on, or plays basic strategy.
+    The interface of a player:
+      decide(round)            True to hit, False to stand, or a (hard, soft) decision plan for
+                               the server to play the rest of the turn. May be a coroutine.
+      card(round, owner, rank, suit)  a card was dealt to PLAYER or DEALER
+      result(round)            the round is over, round.result holds WIN, TIE or LOSS
+    """
+
+    def __init__(self, stand_on=17, basic=None, pipeline=False):
+        self.stand_on = stand_on
+        self.basic = basic
+        self.pipeline = pipeline
+
+    def decide(self, round):
+        dealer_rank = round.dealer[0][0]
+        if self.pipeline:
+            return plan_totals(dealer_rank, self.stand_on, self.basic)
+        return wants_hit(round.player, dealer_rank, self.stand_on, self.basic)
+
+    def card(self, round, owner, rank, suit):
+        pass
+
+    def result(self, round):
+        pass
+
+
+async def connect(host, port):
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.get_extra_info("socket").setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return reader, writer
+
+
+class ConnectionPool:
+    """
+    Connections to one server kept alive between games, so a game can start on a warm
+    connection instead of opening a new one. Connections idle for longer than idle seconds are
+    closed rather than reused, before the server gives up on them.
+    Used from one event loop, shared by any number of its sessions.
+    """
+
+    def __init__(self, host, port, idle=POOL_IDLE):
+        self.host = host
+        self.port = port
+        self.idle = idle
+        self.connections = []  # (reader, writer, released at), most recently released last
+        self.opened = 0
+        self.reused = 0
+
+    @property
+    def warm(self):
+        """
+        :return: True if the next game can start on an open connection
+        """
+        return any(time.monotonic() - released < self.idle for _, _, released in self.connections)
+
+    async def acquire(self):
+        """
+        :return: (reader, writer) of the most recently used connection still fit for reuse, or
+                 of a new connection
+        """
+        now = time.monotonic()
+        while self.connections:
+            reader, writer, released = self.connections.pop()
+            if now - released < self.idle and not reader.at_eof():
+                self.reused += 1
+                return reader, writer
+            writer.close()
+        self.opened += 1
+        return await connect(self.host, self.port)
+
+    def release(self, reader, writer):
+        """
+        Give back a connection whose game is over, for the next game.
+        """
+        self.connections.append((reader, writer, time.monotonic()))
+
+    async def close(self):
+        connections, self.connections = self.connections, []
+        for _, writer, _ in connections:
+            writer.close()
+        for _, writer, _ in connections:
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+
+
+async def play_game(host, port, rounds, team_name, player, latencies=None, pool=None):
+    """
+    Play one game over a new connection, or over a connection of the pool.
+    :param rounds: Number of rounds (1-255)
+    :param player: Decides and is told about the game, see BotPlayer
+    :param latencies: Optional list that collects the seconds between each decision and the
+                      first payload the server sends back for it
+    :param pool: ConnectionPool to the same server: the game asks the server to keep the
+                 connection alive, and gives it back to the pool once over
+    :return: (wins, ties, losses)
+    """
+    results = {WIN: 0, TIE: 0, LOSS: 0}
+    reader, writer = await (connect(host, port) if pool is None else pool.acquire())
+    over = False
+    try:
+        writer.write(pack_request(rounds, team_name, keep_alive=pool is not None))
+
+        async def receive():
+            try:
+                data = await reader.readexactly(PAYLOAD_LEN)
+            except asyncio.IncompleteReadError:
+                raise ConnectionError("Connection lost.") from None
+            package = unpack_server_payload(data)
+            if package[0] == BUSY:
+                raise ConnectionError("Server is full.")
+            return package
+
+        async def decide(packet):
+            sent = time.perf_counter()
+            writer.write(packet)
+            package = await receive()
+            if latencies is not None:
+                latencies.append(time.perf_counter() - sent)
+            return package
+
+        def deal(round, owner, rank, suit):
+            (round.player if owner == PLAYER else round.dealer).append((rank, suit))
+            player.card(round, owner, rank, suit)
+
+        for number in range(1, rounds + 1):
+            round = Round(number)
+            for owner in (PLAYER, PLAYER, DEALER):
+                _, rank, suit = await receive()
+                deal(round, owner, rank, suit)
+
+            res = ROUND_NOT_OVER
+            while True:
+                decision = player.decide(round)
+                if inspect.isawaitable(decision):
+                    decision = await decision
+                if decision is True:
+                    res, rank, suit = await decide(HIT_PACKET)
+                    deal(round, PLAYER, rank, suit)
+                    if res != ROUND_NOT_OVER:  # Busted
+                        break
+                    continue
+                if decision is False:
+                    res, rank, suit = await decide(STAND_PACKET)
+                    owner = DEALER
+                else:
+                    # A plan: the server hits for the player, then the dealer's cards follow
+                    res, rank, suit = await decide(pack_plan(*decision))
+                    owner = PLAYER
+                # Cards until the result, which carries the card of a bust
+                while True:
+                    if rank:
+                        if owner == PLAYER and not plan_hits(round.player, decision):
+                            owner = DEALER
+                        deal(round, owner, rank, suit)
+                    if res != ROUND_NOT_OVER:
+                        break
+                    res, rank, suit = await receive()
+                break
+
+            round.result = res
+            results[res] += 1
+            player.result(round)
+        over = True
+    finally:
+        if over and pool is not None:
+            pool.release(reader, writer)
+        else:
+            writer.close()
+    return results[WIN], results[TIE], results[LOSS]
+
+
+def plan_hits(cards, plan):
+    """
+    :return: True if the server hits a hand of these cards under a (hard, soft) plan
+    """
+    total, soft = calculate_hand(cards)
+    return total < plan[1 if soft else 0]
+
+
+async def run_bots(host, port, sessions, games, rounds, team_name, make_player, latencies=None, pool=None):
+    """
+    Play games from many concurrent sessions, each a coroutine playing its games back to back.
+    :param make_player: Creates the player of each session
+    :param latencies: Optional list that collects the decision latencies of every session
+    :param pool: ConnectionPool the sessions take their connections from, None for a new
+                 connection per game
+    :return: (wins, ties, losses, errors) over all games
+    """
+    totals = [0, 0, 0, 0]
+
+    async def session(index):
+        player = make_player()
+        name = team_name if sessions == 1 else f"{team_name}-{index}"
+        for _ in range(games):
+            try:
+                for i, count in enumerate(await play_game(host, port, rounds, name, player, latencies, pool)):
+                    totals[i] += count
+            except (OSError, ConnectionError):
+                totals[3] += 1
+
+    await asyncio.gather(*(session(index) for index in range(sessions)))
+    return tuple(totals)
@@ -8,12 +8,29 @@ UDP_PORT = 13122
 OFFER_TYPE = 0x2
 REQUEST_TYPE = 0x3
 PAYLOAD_TYPE = 0x4
+TABLES_REQUEST_TYPE = 0x5  # Opt-in multi-table session, sent in place of REQUEST_TYPE
+PROBE_TYPE = 0x6           # Client discovery probe, answered with a unicast offer
+REJECT_TYPE = 0x7          # Server payload turning a connection away, the Result holds the reason
+KEEP_ALIVE = 0x80          # Flag on the Type of a request: after the game, the connection stays
+                           # open for another request instead of being closed
 
 # Result codes
 ROUND_NOT_OVER = 0x0
 TIE = 0x1
 LOSS = 0x2
 WIN = 0x3
+BUSY = 0x4  # Reason of a REJECT_TYPE payload: the server is full
+
+# Frame sizes (bytes) of the fixed-size messages
+OFFER_LEN = 39     # Cookie(4), Type(1), Port(2), Name(32)
+LOAD_OFFER_LEN = 43  # Offer followed by Load(2), Capacity(2), older clients read only the first 39 bytes
+PROBE_LEN = 5      # Cookie(4), Type(1)
+REQUEST_LEN = 38   # Cookie(4), Type(1), Rounds(1), Name(32)
+DECISION_LEN = 10  # Cookie(4), Type(1), Decision(5)
+PAYLOAD_LEN = 9    # Cookie(4), Type(1), Result(1), Rank(2), Suit(1)
+# Multi-table session: the request keeps its 38 bytes, decisions and payloads carry the table id
+TABLE_DECISION_LEN = 11  # Cookie(4), Type(1), Table(1), Decision(5)
+TABLE_PAYLOAD_LEN = 10   # Cookie(4), Type(1), Table(1), Result(1), Rank(2), Suit(1)
 
 class Colors:
     """
@@ -0,0 +1,169 @@
+# UDP server discovery shared by the client and the server.
+# Servers broadcast an offer every second and also answer a client's probe datagram right away
+# with a unicast offer, so a client does not have to wait for the next broadcast. The client
+# keeps its discovery sockets open between games and caches the offers it has seen.
+import select
+import socket
+import time
+from constants import *
+from protocol import pack_probe, unpack_offer, unpack_offer_load
+
+OFFER_TTL = 3.0        # Seconds a cached offer stays valid without being seen again
+PROBE_INTERVAL = 0.25  # Seconds between probes while no server has answered
+
+
+def bind_udp_port(port=UDP_PORT):
+    """
+    UDP socket bound to the discovery port, shared with the other clients and servers
+    on the same machine.
+    """
+    udp_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        udp_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    except AttributeError:
+        # Some OS (like Windows) don't support SO_REUSEPORT, use SO_REUSEADDR
+        udp_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    udp_sock.bind(("", port))
+    return udp_sock
+
+
+class ServerOffer:
+    """
+    A server seen in an offer.
+    """
+    __slots__ = ("addr", "port", "name", "seen", "load", "capacity")
+
+    def __init__(self, addr, port, name, seen):
+        self.addr = addr
+        self.port = port
+        self.name = name
+        self.seen = seen  # time.monotonic() of the last offer
+        self.load = None  # Connections being served, None if the server sends plain offers
+        self.capacity = 0  # Connections it serves at once, 0 for no limit
+
+    def full(self):
+        return bool(self.capacity) and self.load >= self.capacity
+
+    def rank(self):
+        """
+        Sort key, least loaded first. Servers that do not report their load come last.
+        """
+        if self.load is None:
+            return (1, 0.0, 0)
+        return (0, self.load / self.capacity if self.capacity else 0.0, self.load)
+
+    def __repr__(self):
+        return f"ServerOffer({self.name!r}, {self.addr}:{self.port})"
+
+
+class Discovery:
+    """
+    Client side of discovery, kept for the whole client session.
+    Broadcast offers arrive on a socket bound to UDP_PORT; probes are sent from a second,
+    ephemeral socket, so the unicast replies reach this client even when other clients on
+    the same machine share UDP_PORT.
+    """
+
+    def __init__(self, ttl=OFFER_TTL):
+        self.ttl = ttl
+        self.offers = {}  # (addr, port) -> ServerOffer
+        self.listener = bind_udp_port()
+        self.prober = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.prober.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        self.prober.bind(("", 0))
+        self.probe_packet = pack_probe()
+
+    def close(self):
+        self.listener.close()
+        self.prober.close()
+
+    def probe(self):
+        """
+        Ask every server on the LAN for an immediate offer.
+        """
+        try:
+            self.prober.sendto(self.probe_packet, ("<broadcast>", UDP_PORT))
+        except OSError:
+            pass  # No broadcast route, the periodic offers still arrive
+
+    def poll(self, timeout=0.0):
+        """
+        Add the offers that arrive within timeout seconds to the cache.
+        Returns as soon as no more datagrams are waiting once at least one offer arrived.
+        :return: Number of offers received
+        """
+        received = 0
+        deadline = time.monotonic() + timeout
+        sockets = (self.listener, self.prober)
+        while True:
+            ready, _, _ = select.select(sockets, (), (), max(0.0, deadline - time.monotonic()))
+            if not ready:
+                return received
+            for udp_sock in ready:
+                data, addr = udp_sock.recvfrom(1024)
+                if self.add(data, addr[0]):
+                    received += 1
+            if received:
+                deadline = 0  # Drain what is already queued, then return
+
+    def add(self, data, addr):
+        """
+        Cache one offer datagram.
+        :return: The ServerOffer, or None if the datagram is not a valid offer
+        """
+        # Offer: Cookie(4), Type(1), Port(2), Name(32) = 39 bytes
+        offer = unpack_offer(data)
+        if not offer: return None
+        cookie, mtype, server_port, server_name = offer
+        if cookie != MAGIC_COOKIE or mtype != OFFER_TYPE: return None
+
+        entry = self.offers.get((addr, server_port))
+        if entry is None:
+            entry = self.offers[(addr, server_port)] = ServerOffer(
+                addr, server_port, server_name.decode('utf-8').strip('\x00'), 0.0)
+        entry.seen = time.monotonic()
+        load = unpack_offer_load(data)
+        if load is not None:
+            entry.load, entry.capacity = load
+        return entry
+
+    def forget(self, offer):
+        """
+        Drop a server from the cache, e.g. after a failed connection.
+        """
+        self.offers.pop((offer.addr, offer.port), None)
+
+    def servers(self):
+        """
+        :return: The offers seen within the last ttl seconds
+        """
+        expired = time.monotonic() - self.ttl
+        for key in [key for key, entry in self.offers.items() if entry.seen < expired]:
+            del self.offers[key]
+        return list(self.offers.values())
+
+    def find(self, timeout=None):
+        """
+        Pick a server: from the cache when it has a fresh offer from a server with room,
+        otherwise probe until a server answers (saturated servers do not).
+        :param timeout: Seconds to wait for an offer, None to wait forever
+        :return: ServerOffer, or None on timeout
+        """
+        self.poll()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            offer = self.choose(self.servers())
+            if offer is not None:
+                return offer
+            if deadline is not None and time.monotonic() >= deadline:
+                return None
+            self.probe()
+            wait = PROBE_INTERVAL if deadline is None else min(PROBE_INTERVAL, deadline - time.monotonic())
+            self.poll(max(0.0, wait))
+
+    def choose(self, servers):
+        """
+        :return: The least loaded server with room for another connection, None if there is none
+        """
+        servers = [entry for entry in servers if not entry.full()]
+        return min(servers, key=ServerOffer.rank) if servers else None
@@ -0,0 +1,95 @@
+# Buffered reader for the fixed-size TCP messages, shared by the client and the server.
+# A single recv() is not guaranteed to return exactly one message: the peer may coalesce
+# several messages into one segment, or a message may arrive split across segments.
+
+RECV_SIZE = 4096
+
+
+class MessageReader:
+    """
+    Reads whole frames from a stream socket.
+    Each connection has one preallocated buffer that recv_into() fills with as many bytes as
+    are available, so steady-state reads allocate nothing: read_offset() hands out the frame's
+    position in the buffer, for struct.unpack_from() or for matching raw bytes, and read()
+    a memoryview slice of it. A frame stays valid until the next read.
+    """
+
+    def __init__(self, sock, recv_size=RECV_SIZE):
+        self.sock = sock
+        self.recv_calls = 0
+        self.buffer = bytearray(recv_size)
+        self._view = memoryview(self.buffer)
+        self._start = 0  # Next byte not handed out yet
+        self._end = 0    # End of the received bytes
+
+    def pending(self):
+        """
+        :return: Number of bytes received but not handed out yet
+        """
+        return self._end - self._start
+
+    def read_offset(self, size):
+        """
+        Read exactly one frame into the buffer.
+        Socket errors are raised to the caller.
+        :param size: Frame size in bytes
+        :return: Offset of the frame in self.buffer, or -1 if the connection closed before a
+                 whole frame arrived
+        """
+        start = self._start
+        if self._end - start < size:
+            start = self._receive(size)
+            if start < 0:
+                return -1
+        self._start = start + size
+        return start
+
+    def read(self, size):
+        """
+        Read exactly one frame.
+        :return: memoryview of the frame, or None if the connection closed before a whole frame arrived
+        """
+        offset = self.read_offset(size)
+        if offset < 0:
+            return None
+        return self._view[offset:offset + size]
+
+    def peek(self, size):
+        """
+        Like read(), but the frame is not consumed: the next read returns the same bytes.
+        """
+        frame = self.read(size)
+        if frame is not None:
+            self._start -= size
+        return frame
+
+    def _receive(self, size):
+        """
+        Receive until a whole frame of size bytes is buffered.
+        :return: Offset of the frame, or -1 on EOF
+        """
+        start, end = self._start, self._end
+        if start == end:
+            start = end = 0
+        elif start + size > len(self.buffer):
+            # Move the partial frame to the front to make room for the rest. The buffer is at
+            # least two frames long, so the two ranges never overlap.
+            self.buffer[:end - start] = self._view[start:end]
+            start, end = 0, end - start
+        if size * 2 > len(self.buffer):
+            # A frame larger than the buffer: replace it (frames handed out keep the old one)
+            buffer = bytearray(size * 2)
+            buffer[:end - start] = self._view[start:end]
+            self.buffer, self._view = buffer, memoryview(buffer)
+            start, end = 0, end - start
+
+        while end - start < size:
+            received = self.sock.recv_into(self._view[end:])
+            self.recv_calls += 1
+            if not received:
+                self._start = self._end = 0
+                return -1
+            end += received
+
+        self._start, self._end = start, end
+        return start
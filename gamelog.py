@@ -0,0 +1,115 @@
+# Server logging off the game hot path.
+# Game threads only put log records on a queue; a background writer thread formats them
+# (colors, card names) and writes them out. Per-card messages are logged at DEBUG with
+# %-style arguments, so nothing is formatted unless DEBUG is enabled.
+# An optional game-event log writes one JSON object per line for auditing; when it is off
+# the game skips building events altogether.
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import background
+from constants import Colors
+
+logger = logging.getLogger("blackjack")
+event_logger = logging.getLogger("blackjack.events")
+event_logger.propagate = False
+event_logger.setLevel(logging.CRITICAL + 1)  # Off until configure() gets an event file
+
+_writer = background.Slot()
+
+
+class GameFormatter(logging.Formatter):
+    """
+    Console format of the server: game messages are prefixed with the team and round, or
+    with the client address before the game starts.
+    """
+
+    def format(self, record):
+        message = record.getMessage()
+        round_num = getattr(record, "round", 0)
+        if round_num:
+            log = f"[Team: {record.team}, Round: {round_num}]"
+            return f"{Colors.RED}{log}{Colors.RESET} {message}"
+        client = getattr(record, "client", None)
+        if client is not None:
+            return f"[Client {client}] {message}"
+        return message
+
+
+class EventFormatter(logging.Formatter):
+    """
+    One compact JSON object per event: time, event name and the event's fields.
+    """
+
+    def format(self, record):
+        return json.dumps({"time": round(record.created, 6), "event": record.msg, **record.fields},
+                          separators=(",", ":"))
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queues records as they are. The stock QueueHandler formats the message in the logging
+    thread, here it is left to the writer thread (log arguments must not change afterwards).
+    """
+
+    def prepare(self, record):
+        return record
+
+
+class LogWriter(logging.handlers.QueueListener):
+    """
+    The writer thread, owning the handlers it writes to.
+    """
+
+    def close(self):
+        self.stop()
+        for handler in self.handlers:
+            handler.close()
+
+
+def configure(level=logging.DEBUG, event_file=None):
+    """
+    Route server logging through a queue to a background writer thread.
+    :param level: Console log level (name or number)
+    :param event_file: Path of the JSONL game-event log, None to turn it off
+    """
+    console = logging.StreamHandler(sys.stdout)
+    console.setFormatter(GameFormatter())
+    handlers = [console]
+    if event_file:
+        events = logging.FileHandler(event_file)
+        events.setFormatter(EventFormatter())
+        events.addFilter(lambda record: record.name == event_logger.name)
+        console.addFilter(lambda record: record.name != event_logger.name)
+        handlers.append(events)
+
+    log_queue = queue.SimpleQueue()
+    for log in (logger, event_logger):
+        log.handlers = [DeferredQueueHandler(log_queue)]
+    logger.propagate = False
+    logger.setLevel(level)
+    event_logger.setLevel(logging.INFO if event_file else logging.CRITICAL + 1)
+
+    writer = LogWriter(log_queue, *handlers)
+    writer.start()
+    _writer.start(writer)
+
+
+def shutdown():
+    """
+    Write out everything still queued and stop the writer thread.
+    """
+    _writer.stop()
+
+
+def events_enabled():
+    return event_logger.isEnabledFor(logging.INFO)
+
+
+def event(name, **fields):
+    """
+    Record one game event. Callers check events_enabled() first so no event is built when off.
+    """
+    event_logger.info(name, extra={"fields": fields})
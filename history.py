@@ -0,0 +1,274 @@
+# Persistent game history in an SQLite database in WAL mode.
+# Game threads only put finished games on a queue; a background writer thread inserts them in
+# batches, one transaction per batch, so games never wait for the disk. A batch that fails
+# (database locked, disk full) is logged and lost, and games are dropped rather than queued
+# without limit while the writer falls behind. Games and rounds are
+# append-only, and a per-team aggregate is updated in the same transaction, so win rates are
+# read without scanning the history. WAL lets reporting tools read the database (through
+# SQLite's memory-mapped I/O) while the server writes it.
+# Usage: python history.py history.db [--team NAME] [--since SECONDS]
+import argparse
+import queue
+import sqlite3
+import threading
+import time
+import urllib.parse
+import background
+from gamelog import logger
+
+BATCH_SIZE = 256        # Games per transaction at most
+MAX_QUEUED = 65536      # Games waiting for the writer at most, more are dropped
+FLUSH_INTERVAL = 0.5    # Seconds a queued game waits for more to batch with
+MMAP_SIZE = 256 << 20   # Bytes of the database readers map into memory
+BUSY_TIMEOUT = 5000     # Milliseconds to wait for another writer (forked workers share the file)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS games (
+    id INTEGER PRIMARY KEY,
+    team TEXT NOT NULL,
+    started REAL NOT NULL,  -- Unix time
+    ended REAL NOT NULL,
+    rounds INTEGER NOT NULL,
+    wins INTEGER NOT NULL,
+    ties INTEGER NOT NULL,
+    losses INTEGER NOT NULL
+);
+-- Covers the per-team queries over a time range
+CREATE INDEX IF NOT EXISTS games_team ON games (team, ended, rounds, wins, ties, losses);
+CREATE INDEX IF NOT EXISTS games_ended ON games (ended);
+CREATE TABLE IF NOT EXISTS rounds (
+    game INTEGER NOT NULL REFERENCES games (id),
+    round INTEGER NOT NULL,
+    player BLOB NOT NULL,  -- Card indexes, see cards.CARDS
+    dealer BLOB NOT NULL,
+    result INTEGER NOT NULL,
+    PRIMARY KEY (game, round)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS teams (
+    team TEXT PRIMARY KEY,
+    games INTEGER NOT NULL,
+    rounds INTEGER NOT NULL,
+    wins INTEGER NOT NULL,
+    ties INTEGER NOT NULL,
+    losses INTEGER NOT NULL
+) WITHOUT ROWID;
+"""
+
+UPDATE_TEAM = """
+INSERT INTO teams (team, games, rounds, wins, ties, losses) VALUES (?, 1, ?, ?, ?, ?)
+ON CONFLICT (team) DO UPDATE SET
+    games = games + 1, rounds = rounds + excluded.rounds, wins = wins + excluded.wins,
+    ties = ties + excluded.ties, losses = losses + excluded.losses
+"""
+
+STATS = ("games", "rounds", "wins", "ties", "losses")
+
+
+def connect(path):
+    """
+    Open the database for writing, creating it if needed.
+    """
+    db = sqlite3.connect(path, timeout=BUSY_TIMEOUT / 1000)
+    db.execute("PRAGMA journal_mode = WAL")
+    # In WAL mode a commit is durable once the WAL is synced at checkpoints: a power loss may
+    # lose the last batches, never corrupt the file
+    db.execute("PRAGMA synchronous = NORMAL")
+    db.executescript(SCHEMA)
+    return db
+
+
+class HistoryWriter:
+    """
+    Background writer thread of the history database.
+    """
+
+    def __init__(self, path, batch=BATCH_SIZE, interval=FLUSH_INTERVAL, max_queued=MAX_QUEUED):
+        self.path = path
+        self.batch = batch
+        self.interval = interval
+        self.queue = queue.Queue(max_queued)
+        self.written = 0
+        self.dropped = 0  # Games dropped on a full queue
+        self.dropping = False  # Dropping since the last batch written, logged once
+        self.failed = 0   # Games lost in failed batches
+        connect(path).close()  # Fail here rather than in the thread on a bad path
+        self.thread = threading.Thread(target=self._run, name="history-writer", daemon=True)
+        self.thread.start()
+
+    def record(self, team, started, ended, wins, ties, losses, rounds):
+        """
+        Queue one finished game, never blocks: the game is dropped when the queue is full.
+        :param rounds: List of (round, player cards, dealer cards, result), cards as bytes
+        """
+        try:
+            self.queue.put_nowait((team, started, ended, wins, ties, losses, rounds))
+        except queue.Full:
+            if not self.dropping:
+                self.dropping = True
+                logger.warning("History writer is behind, dropping games.")
+            self.dropped += 1
+
+    def close(self):
+        """
+        Write out everything queued and stop the thread.
+        """
+        self.queue.put(None)
+        self.thread.join()
+
+    def _run(self):
+        db = None
+        try:
+            running = True
+            while running:
+                batch = [self.queue.get()]
+                deadline = time.monotonic() + self.interval
+                while batch[-1] is not None and len(batch) < self.batch:
+                    try:
+                        batch.append(self.queue.get(timeout=max(0.0, deadline - time.monotonic())))
+                    except queue.Empty:
+                        break
+                if batch[-1] is None:
+                    running = False
+                    batch.pop()
+                if batch:
+                    try:
+                        if db is None:
+                            db = connect(self.path)
+                        self._write(db, batch)
+                    except sqlite3.Error:
+                        self.failed += len(batch)
+                        logger.exception("History: failed to write %d games", len(batch))
+        finally:
+            if db is not None:
+                db.close()
+
+    def _write(self, db, batch):
+        with db:  # One transaction per batch
+            for team, started, ended, wins, ties, losses, rounds in batch:
+                game = db.execute(
+                    "INSERT INTO games (team, started, ended, rounds, wins, ties, losses) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (team, started, ended, len(rounds), wins, ties, losses)).lastrowid
+                db.executemany("INSERT INTO rounds VALUES (?, ?, ?, ?, ?)",
+                               [(game, *entry) for entry in rounds])
+                db.execute(UPDATE_TEAM, (team, len(rounds), wins, ties, losses))
+        self.written += len(batch)
+        self.dropping = False
+
+
+class HistoryReader:
+    """
+    Read-only queries, safe to run while a server writes the database.
+    """
+
+    def __init__(self, path, mmap_size=MMAP_SIZE):
+        self.db = sqlite3.connect(f"file:{urllib.parse.quote(path)}?mode=ro", uri=True)
+        self.db.execute(f"PRAGMA mmap_size = {int(mmap_size)}")
+
+    def close(self):
+        self.db.close()
+
+    def team(self, team, since=None):
+        """
+        :param since: Unix time, only count games that ended after it (None for all games)
+        :return: Dict of games, rounds, wins, ties and losses, None for an unknown team
+        """
+        if since is None:
+            row = self.db.execute("SELECT games, rounds, wins, ties, losses FROM teams WHERE team = ?",
+                                  (team,)).fetchone()
+        else:
+            # A range of the covering index, the table itself is not read
+            row = self.db.execute(
+                "SELECT COUNT(*), SUM(rounds), SUM(wins), SUM(ties), SUM(losses) FROM games "
+                "WHERE team = ? AND ended >= ?", (team, since)).fetchone()
+            if not row[0]:
+                row = None
+        return dict(zip(STATS, row)) if row else None
+
+    def win_rate(self, team, since=None):
+        """
+        :return: Wins per round of the team, None if it has no rounds
+        """
+        stats = self.team(team, since)
+        return stats["wins"] / stats["rounds"] if stats and stats["rounds"] else None
+
+    def teams(self):
+        """
+        :return: {team: stats dict} for every team
+        """
+        return {row[0]: dict(zip(STATS, row[1:]))
+                for row in self.db.execute("SELECT team, games, rounds, wins, ties, losses FROM teams")}
+
+    def games(self, team=None, since=None, limit=100):
+        """
+        :return: The most recent games as dicts, newest first
+        """
+        query = "SELECT id, team, started, ended, rounds, wins, ties, losses FROM games"
+        conditions, args = [], []
+        if team is not None:
+            conditions.append("team = ?")
+            args.append(team)
+        if since is not None:
+            conditions.append("ended >= ?")
+            args.append(since)
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY ended DESC LIMIT ?"
+        columns = ("id", "team", "started", "ended", "rounds", "wins", "ties", "losses")
+        return [dict(zip(columns, row)) for row in self.db.execute(query, (*args, limit))]
+
+    def rounds(self, game):
+        """
+        :return: List of (round, player cards, dealer cards, result) of one game
+        """
+        return [(number, bytes(player), bytes(dealer), result) for number, player, dealer, result in
+                self.db.execute("SELECT round, player, dealer, result FROM rounds WHERE game = ? ORDER BY round",
+                                (game,))]
+
+
+_writer = background.Slot()
+
+
+def start(path):
+    """
+    Record finished games to the database at path from now on.
+    """
+    _writer.start(HistoryWriter(path))
+
+
+def stop():
+    """
+    Write out the queued games and stop recording.
+    """
+    _writer.stop()
+
+
+def writer():
+    """
+    :return: The process's HistoryWriter, None when history is off
+    """
+    return _writer.current
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-team results from the game history")
+    parser.add_argument("database")
+    parser.add_argument("--team", help="only this team")
+    parser.add_argument("--since", type=float, default=None, metavar="SECONDS",
+                        help="only games that ended within the last SECONDS")
+    args = parser.parse_args()
+
+    reader = HistoryReader(args.database)
+    since = None if args.since is None else time.time() - args.since
+    if args.team is not None:
+        stats = reader.team(args.team, since)
+        teams = {args.team: stats} if stats else {}
+    elif since is None:
+        teams = reader.teams()
+    else:
+        teams = {team: reader.team(team, since) for team in reader.teams()}
+        teams = {team: stats for team, stats in teams.items() if stats}
+    for team, stats in sorted(teams.items()):
+        print(f"{team:<32} {stats['games']:>6} games {stats['rounds']:>8} rounds  "
+              f"win rate {stats['wins'] / (stats['rounds'] or 1):.1%}")
+    reader.close()
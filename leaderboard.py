@@ -0,0 +1,179 @@
+# Live per-team results, updated as each round ends.
+# Teams are spread over shards by name, each with its own lock, so game threads playing for
+# different teams rarely wait for each other; a round costs one uncontended lock and a few
+# integer increments. Top-K queries go through a heap of size K instead of sorting every team.
+# The board is snapshotted to a JSON file periodically and reloaded from it on start, and is
+# served as JSON on the metrics endpoint (/leaderboard, see metrics.MetricsHandler).
+import heapq
+import json
+import os
+import threading
+import background
+from constants import LOSS, TIE, WIN
+
+SHARDS = 16
+SNAPSHOT_INTERVAL = 30.0  # Seconds between two snapshots
+
+
+class Shard:
+    __slots__ = ("lock", "teams")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # team -> [rounds, ties, losses, wins]: indexed by result code, index 0 counts rounds
+        self.teams = {}
+
+
+def stats_dict(team, stats):
+    rounds = stats[0]
+    return {"team": team, "rounds": rounds, "wins": stats[WIN], "ties": stats[TIE], "losses": stats[LOSS],
+            "win_rate": stats[WIN] / rounds if rounds else 0.0}
+
+
+class Leaderboard:
+    """
+    Per-team rounds, wins, ties and losses, thread-safe.
+    """
+
+    def __init__(self, shards=SHARDS):
+        self.shards = [Shard() for _ in range(shards)]
+        self.snapshotter = None  # Snapshotter writing the board to its file, see start()
+
+    def _shard(self, team):
+        return self.shards[hash(team) % len(self.shards)]
+
+    def record(self, team, result):
+        """
+        Count one finished round.
+        :param result: WIN, TIE or LOSS
+        """
+        shard = self._shard(team)
+        with shard.lock:
+            stats = shard.teams.get(team)
+            if stats is None:
+                stats = shard.teams[team] = [0, 0, 0, 0]
+            stats[0] += 1
+            stats[result] += 1
+
+    def team(self, team):
+        """
+        :return: The team's stats dict, None for a team that played no round
+        """
+        shard = self._shard(team)
+        with shard.lock:
+            stats = shard.teams.get(team)
+            return None if stats is None else stats_dict(team, stats)
+
+    def entries(self):
+        """
+        :return: List of (team, [rounds, ties, losses, wins]), copied shard by shard
+        """
+        entries = []
+        for shard in self.shards:
+            with shard.lock:
+                entries.extend((team, stats.copy()) for team, stats in shard.teams.items())
+        return entries
+
+    def top(self, k=10, min_rounds=1):
+        """
+        :param min_rounds: Leave out teams with fewer rounds, whose win rates mean little
+        :return: Stats dicts of the k teams with the best win rate, best first (ties go to
+                 the team with more rounds)
+        """
+        ranked = ((stats[WIN] / stats[0], stats[0], team, stats)
+                  for team, stats in self.entries() if stats[0] >= min_rounds)
+        return [stats_dict(team, stats) for _, _, team, stats in
+                heapq.nlargest(k, ranked, key=lambda entry: entry[:3])]
+
+    def snapshot(self, path):
+        """
+        Write the board to path atomically.
+        """
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump({team: stats for team, stats in self.entries()}, f, separators=(",", ":"))
+        os.replace(tmp, path)
+
+    def restore(self, path):
+        """
+        Add the counts of a snapshot to the board. A missing snapshot is an empty board.
+        """
+        try:
+            with open(path) as f:
+                teams = json.load(f)
+        except FileNotFoundError:
+            return
+        for team, stats in teams.items():
+            shard = self._shard(team)
+            with shard.lock:
+                current = shard.teams.setdefault(team, [0, 0, 0, 0])
+                for i, count in enumerate(stats):
+                    current[i] += count
+
+    def close(self):
+        """
+        Write the last snapshot and stop the snapshot thread, if any.
+        """
+        if self.snapshotter is not None:
+            self.snapshotter.stop()
+            self.snapshotter = None
+
+
+class Snapshotter:
+    """
+    Thread that snapshots a board to a file every interval seconds, and once more on stop().
+    """
+
+    def __init__(self, board, path, interval=SNAPSHOT_INTERVAL):
+        self.board = board
+        self.path = path
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="leaderboard-snapshot", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self._snapshot()
+
+    def _snapshot(self):
+        try:
+            self.board.snapshot(self.path)
+        except OSError:
+            pass  # Try again next time, the board itself is intact
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        self._snapshot()
+
+
+_board = background.Slot()
+
+
+def start(path=None, interval=SNAPSHOT_INTERVAL):
+    """
+    Keep a leaderboard in this process from now on.
+    :param path: Snapshot file, restored now and rewritten every interval seconds (None for
+                 no snapshots)
+    """
+    _board.stop()  # Its last snapshot first, it may be the file restored here
+    board = Leaderboard()
+    if path:
+        board.restore(path)
+        board.snapshotter = Snapshotter(board, path, interval)
+    _board.start(board)
+
+
+def stop():
+    """
+    Write the last snapshot and stop updating the board.
+    """
+    _board.stop()
+
+
+def board():
+    """
+    :return: The process's Leaderboard, None when it is off
+    """
+    return _board.current
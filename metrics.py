@@ -0,0 +1,269 @@
+# Runtime metrics of the server, exposed in the Prometheus text format over a local HTTP endpoint.
+# Every thread updates its own cell of each metric, so the hot path takes no lock: a game thread
+# only touches its cells, and a scrape sums the cells of all threads. When a connection thread
+# ends, its cells are folded into the metric's retired total (one lock per thread, not per update).
+# In the multi-process server each worker has its own metrics and its own endpoint.
+import bisect
+import collections
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import leaderboard
+
+REGISTRY = []
+_lock = threading.Lock()
+
+
+class Counter:
+    """
+    Value that only goes up.
+    """
+    kind = "counter"
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self._local = threading.local()
+        self._cells = {}  # thread ident -> cell
+        self._retired = self._new_cell()
+        REGISTRY.append(self)
+
+    def _new_cell(self):
+        return [0]
+
+    def _cell(self):
+        try:
+            return self._local.cell
+        except AttributeError:
+            cell = self._local.cell = self._new_cell()
+            with _lock:
+                self._cells[threading.get_ident()] = cell
+            return cell
+
+    def inc(self, amount=1):
+        self._cell()[0] += amount
+
+    def value(self):
+        with _lock:
+            cells = [self._retired, *self._cells.values()]
+        return sum(cell[0] for cell in cells)
+
+    def retire(self, ident):
+        """
+        Fold the cell of a finished thread into the retired total.
+        """
+        with _lock:
+            cell = self._cells.pop(ident, None)
+            if cell is not None:
+                for i, value in enumerate(cell):
+                    self._retired[i] += value
+
+    def expose(self):
+        return [f"{self.name} {self.value()}"]
+
+
+class Gauge(Counter):
+    """
+    Value that goes up and down (inc and dec may happen on different threads).
+    """
+    kind = "gauge"
+
+    def dec(self, amount=1):
+        self._cell()[0] -= amount
+
+
+class Histogram(Counter):
+    """
+    Distribution of observed values in cumulative buckets, plus their sum and count.
+    """
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets):
+        self.buckets = tuple(buckets)
+        super().__init__(name, help_text)
+
+    def _new_cell(self):
+        # One count per bucket, one for +Inf, then the sum
+        return [0] * (len(self.buckets) + 2)
+
+    def observe(self, value):
+        cell = self._cell()
+        cell[bisect.bisect_left(self.buckets, value)] += 1
+        cell[-1] += value
+
+    def totals(self):
+        with _lock:
+            cells = [self._retired, *self._cells.values()]
+        return [sum(column) for column in zip(*cells)]
+
+    def expose(self):
+        totals = self.totals()
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ("+Inf",), totals):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f"{self.name}_sum {totals[-1]}")
+        lines.append(f"{self.name}_count {cumulative}")
+        return lines
+
+
+ACTIVE_GAMES = Gauge("blackjack_active_games", "Games currently being played")
+ACTIVE_CONNECTIONS = Gauge("blackjack_active_connections", "Client connections currently being served")
+GAMES = Counter("blackjack_games_total", "Games started after a valid handshake")
+ROUNDS = Counter("blackjack_rounds_total", "Rounds completed")
+HANDSHAKE_FAILURES = Counter("blackjack_handshake_failures_total", "Connections with an invalid or missing request")
+HANDSHAKE_TIMEOUTS = Counter("blackjack_handshake_timeouts_total", "Connections that timed out before the request")
+DECISION_TIMEOUTS = Counter("blackjack_decision_timeouts_total", "Games that timed out waiting for a decision")
+KEEP_ALIVE_GAMES = Counter("blackjack_keep_alive_games_total", "Games requested on a kept-alive connection")
+IDLE_TIMEOUTS = Counter("blackjack_idle_timeouts_total", "Kept-alive connections closed waiting for a request")
+REJECTED = Counter("blackjack_rejected_total", "Connections turned away by admission control")
+OFFERS_SENT = Counter("blackjack_offers_sent_total", "UDP offers sent, broadcasts and replies to probes")
+BYTES_PER_ROUND = Histogram("blackjack_round_bytes", "Bytes sent and received per round",
+                            (64, 96, 128, 160, 192, 256, 384))
+SYSCALLS_PER_ROUND = Histogram("blackjack_round_syscalls", "Send and receive syscalls per round",
+                               (1, 2, 3, 4, 6, 8, 12, 16))
+DECISION_LATENCY = Histogram("blackjack_decision_seconds",
+                             "Server time from receiving a decision to sending its payloads",
+                             (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.01))
+
+
+def retire_thread():
+    """
+    Called by a connection thread when it ends.
+    """
+    ident = threading.get_ident()
+    for metric in REGISTRY:
+        metric.retire(ident)
+
+
+def expose():
+    """
+    :return: All metrics in the Prometheus text exposition format
+    """
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.expose())
+    return "\n".join(lines) + "\n"
+
+
+class SamplingProfiler:
+    """
+    Low-overhead profiler that can be turned on and off while the server runs: a background
+    thread samples the stack of every other thread at a fixed interval and counts the stacks
+    in the collapsed format used by flame graph tools ("outer;inner;leaf count").
+    """
+
+    def __init__(self):
+        self.samples = collections.Counter()
+        self.thread = None
+        self.running = threading.Event()
+
+    def start(self, interval=0.005):
+        if self.thread is not None:
+            return
+        self.samples.clear()
+        self.running.set()
+        self.thread = threading.Thread(target=self._run, args=(interval,), daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if self.thread is None:
+            return
+        self.running.clear()
+        self.thread.join()
+        self.thread = None
+
+    def _run(self, interval):
+        me = threading.get_ident()
+        while self.running.is_set():
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{frame.f_lineno})")
+                    frame = frame.f_back
+                self.samples[";".join(reversed(stack))] += 1
+            time.sleep(interval)
+
+    def report(self):
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+
+PROFILER = SamplingProfiler()
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """
+    GET /metrics                         Prometheus metrics
+    GET /profile/start?interval=0.005    Start the sampling profiler
+    GET /profile/stop                    Stop it and return the collapsed stacks
+    GET /profile                         Collapsed stacks sampled so far
+    GET /leaderboard?k=10&min_rounds=1   Top teams by win rate, JSON (with --leaderboard)
+    GET /leaderboard/team?name=TEAM      One team's results, JSON
+    """
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/metrics":
+            self.reply(expose(), "text/plain; version=0.0.4")
+        elif url.path == "/profile/start":
+            interval = float(parse_qs(url.query).get("interval", ["0.005"])[0])
+            PROFILER.start(interval)
+            self.reply("Profiler started\n")
+        elif url.path == "/profile/stop":
+            PROFILER.stop()
+            self.reply(PROFILER.report())
+        elif url.path == "/profile":
+            self.reply(PROFILER.report())
+        elif url.path.startswith("/leaderboard"):
+            self.leaderboard(url)
+        else:
+            self.send_error(404)
+
+    def leaderboard(self, url):
+        board = leaderboard.board()
+        query = parse_qs(url.query)
+        if board is None:
+            self.send_error(404, "Leaderboard is off")
+        elif url.path == "/leaderboard":
+            k = int(query.get("k", ["10"])[0])
+            min_rounds = int(query.get("min_rounds", ["1"])[0])
+            self.reply(json.dumps(board.top(k, min_rounds)), "application/json")
+        elif url.path == "/leaderboard/team":
+            stats = board.team(query.get("name", [""])[0])
+            if stats is None:
+                self.send_error(404, "Unknown team")
+            else:
+                self.reply(json.dumps(stats), "application/json")
+        else:
+            self.send_error(404)
+
+    def reply(self, text, content_type="text/plain"):
+        body = text.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Keep scrapes out of the game log
+
+
+def start_http_server(port, host="127.0.0.1"):
+    """
+    Serve the metrics endpoint from a daemon thread.
+    :return: The HTTP server
+    """
+    httpd = ThreadingHTTPServer((host, port), MetricsHandler)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd
@@ -0,0 +1,276 @@
+# Packet encoding and decoding shared by the client and the server.
+# The struct formats are compiled once here instead of being parsed again on every call,
+# and every server payload that carries a card is prebuilt in a lookup table.
+import struct
+from constants import *
+
+# ! = Network (Big Endian), I = Int(4), B = Char(1), H = Short(2), Ns = N bytes string
+OFFER = struct.Struct("!IBH32s")    # Cookie, Type, Port, Name
+LOAD = struct.Struct("!HH")         # Load, Capacity - appended to the offer
+PROBE = struct.Struct("!IB")        # Cookie, Type
+REQUEST = struct.Struct("!IBB32s")  # Cookie, Type, Rounds, Name
+DECISION = struct.Struct("!IB5s")   # Cookie, Type, Decision
+PAYLOAD = struct.Struct("!IBBHB")   # Cookie, Type, Result, Rank, Suit
+# Multi-table session (see constants.TABLES_REQUEST_TYPE)
+TABLES_REQUEST = struct.Struct("!IBBB31s")  # Cookie, Type, Rounds per table, Tables, Name
+TABLE_DECISION = struct.Struct("!IBB5s")    # Cookie, Type, Table, Decision
+TABLE_PAYLOAD = struct.Struct("!IBBBHB")    # Cookie, Type, Table, Result, Rank, Suit
+# Decision plans, in the decision layouts: the 5 decision bytes are 'P', Hard(1), Soft(1), padding
+PLAN = struct.Struct("!IBcBB2x")            # Cookie, Type, 'P', Hard stand total, Soft stand total
+TABLE_PLAN = struct.Struct("!IBBcBB2x")     # Cookie, Type, Table, 'P', Hard stand total, Soft stand total
+
+NAME_LEN = 32
+TABLES_NAME_LEN = 31  # The table count takes the first byte of the name field
+RESULTS = (ROUND_NOT_OVER, TIE, LOSS, WIN)
+
+
+def card_index(rank, suit):
+    """
+    Index of a card in the 52-entry payload tables.
+    :param rank: 1-13 (Ace to King)
+    :param suit: 0-3
+    """
+    return (rank - 1) * 4 + suit
+
+
+# CARD_PAYLOADS[result][card_index(rank, suit)] -> the 9 payload bytes for that card and result
+CARD_PAYLOADS = tuple(
+    tuple(PAYLOAD.pack(MAGIC_COOKIE, PAYLOAD_TYPE, result, rank, suit)
+          for rank in range(1, 14) for suit in range(4))
+    for result in RESULTS)
+# RESULT_PAYLOADS[result] -> the 9 payload bytes with no card attached
+RESULT_PAYLOADS = tuple(PAYLOAD.pack(MAGIC_COOKIE, PAYLOAD_TYPE, result, 0, 0) for result in RESULTS)
+# Sent instead of the first deal when the server is full, in the 9-byte layout whatever the request
+BUSY_PAYLOAD = PAYLOAD.pack(MAGIC_COOKIE, REJECT_TYPE, BUSY, 0, 0)
+
+HIT_DECISION = b"Hittt"
+STAND_DECISION = b"Stand"
+HIT_PACKET = DECISION.pack(MAGIC_COOKIE, PAYLOAD_TYPE, HIT_DECISION)
+STAND_PACKET = DECISION.pack(MAGIC_COOKIE, PAYLOAD_TYPE, STAND_DECISION)
+# TABLE_HIT_PACKETS[table] -> the 11 decision bytes of a hit on that table, same for stands
+TABLE_HIT_PACKETS = tuple(TABLE_DECISION.pack(MAGIC_COOKIE, PAYLOAD_TYPE, table, HIT_DECISION)
+                          for table in range(256))
+TABLE_STAND_PACKETS = tuple(TABLE_DECISION.pack(MAGIC_COOKIE, PAYLOAD_TYPE, table, STAND_DECISION)
+                            for table in range(256))
+# First decision byte of a plan: the server plays the player's whole turn from it, hitting while
+# the hand is below the plan's stand total, and streams every card and the result in one burst
+PLAN_MARK = b"P"
+
+
+def pad_name(name, length=NAME_LEN):
+    """
+    Encode a name into the fixed 32 bytes field, padded with null bytes.
+    Long names are cut on a character boundary, never inside a multibyte character.
+    """
+    encoded = name.encode('utf-8')[:length].decode('utf-8', 'ignore').encode('utf-8')
+    return encoded.ljust(length, b'\x00')
+
+
+def unpad_name(name_bytes):
+    # Other clients may still cut a character in half
+    return bytes(name_bytes).decode('utf-8', 'replace').strip('\x00')
+
+
+def pack_server_payload(result, rank=0, suit=0):
+    """
+    Server -> Client (9 bytes): Cookie(4), Type(1), Result(1), Rank(2), Suit(1)
+    A rank of 0 means no card is attached.
+    """
+    if rank:
+        return CARD_PAYLOADS[result][card_index(rank, suit)]
+    return RESULT_PAYLOADS[result]
+
+
+def pack_server_payload_into(buffer, offset, result, rank=0, suit=0):
+    """
+    Same packet as pack_server_payload, written into a preallocated buffer at the given offset.
+    """
+    PAYLOAD.pack_into(buffer, offset, MAGIC_COOKIE, PAYLOAD_TYPE, result, rank, suit)
+
+
+def unpack_server_payload(data, offset=0):
+    """
+    Server -> Client (9 bytes): Cookie(4), Type(1), Result(1), Rank(2), Suit(1)
+    :param offset: Where the packet starts in data
+    :return: (result, rank, suit), or None if the packet is incomplete
+    """
+    if not data or len(data) < offset + PAYLOAD_LEN: return None
+    return PAYLOAD.unpack_from(data, offset)[2:]
+
+
+def pack_client_decision(decision):
+    """
+    Client -> Server (10 bytes): Cookie(4), Type(1), Decision(5)
+    """
+    # Decision must be 5 bytes: "Hittt" or "Stand"
+    if decision == HIT_DECISION: return HIT_PACKET
+    if decision == STAND_DECISION: return STAND_PACKET
+    return DECISION.pack(MAGIC_COOKIE, PAYLOAD_TYPE, decision)
+
+
+def pack_plan(hard, soft):
+    """
+    Client -> Server (10 bytes): Cookie(4), Type(1), 'P'(1), Hard(1), Soft(1), Padding(2)
+    :param hard: Stand once a hard hand reaches this total
+    :param soft: Stand once a soft hand (an ace counted as 11) reaches this total
+    """
+    return PLAN.pack(MAGIC_COOKIE, PAYLOAD_TYPE, PLAN_MARK, hard, soft)
+
+
+def pack_table_plan(table, hard, soft):
+    """
+    Client -> Server (11 bytes): Cookie(4), Type(1), Table(1), 'P'(1), Hard(1), Soft(1), Padding(2)
+    """
+    return TABLE_PLAN.pack(MAGIC_COOKIE, PAYLOAD_TYPE, table, PLAN_MARK, hard, soft)
+
+
+def unpack_plan(decision):
+    """
+    :param decision: The 5 decision bytes of a decision packet
+    :return: (hard, soft) stand totals if the decision is a plan, None otherwise
+    """
+    if decision[:1] != PLAN_MARK: return None
+    return decision[1], decision[2]
+
+
+def is_rejection(data):
+    """
+    :return: True if a server payload (at least its first 9 bytes) turns the connection away
+    """
+    return len(data) >= PAYLOAD_LEN and data[4] == REJECT_TYPE
+
+
+def unpack_client_payload(data, offset=0):
+    """
+    Client -> Server (10 bytes): Cookie(4), Type(1), Decision(5)
+    :param offset: Where the packet starts in data
+    :return: (cookie, type, decision), all None if the packet is malformed
+    """
+    try:
+        return DECISION.unpack_from(data, offset)
+    except struct.error:
+        return None, None, None
+
+
+def pack_request(rounds, team_name, keep_alive=False):
+    """
+    Client -> Server (38 bytes): Cookie(4), Type(1), Rounds(1), Name(32)
+    :param keep_alive: Ask the server to wait for another request once the game is over
+    """
+    mtype = REQUEST_TYPE | KEEP_ALIVE if keep_alive else REQUEST_TYPE
+    return REQUEST.pack(MAGIC_COOKIE, mtype, rounds, pad_name(team_name))
+
+
+def unpack_request(data):
+    """
+    Client -> Server (38 bytes): Cookie(4), Type(1), Rounds(1), Name(32)
+    :return: (cookie, type, rounds, team_name bytes), or None if the packet is incomplete
+    """
+    if not data or len(data) < REQUEST_LEN: return None
+    return REQUEST.unpack_from(data)
+
+
+def is_tables_request(data):
+    """
+    :return: True if a 38-byte request asks for a multi-table session
+    """
+    return data is not None and len(data) >= REQUEST_LEN and data[4] & ~KEEP_ALIVE == TABLES_REQUEST_TYPE
+
+
+def pack_tables_request(rounds, tables, team_name, keep_alive=False):
+    """
+    Client -> Server (38 bytes): Cookie(4), Type(1), Rounds per table(1), Tables(1), Name(31)
+    :param keep_alive: Ask the server to wait for another request once the session is over
+    """
+    mtype = TABLES_REQUEST_TYPE | KEEP_ALIVE if keep_alive else TABLES_REQUEST_TYPE
+    return TABLES_REQUEST.pack(MAGIC_COOKIE, mtype, rounds, tables, pad_name(team_name, TABLES_NAME_LEN))
+
+
+def unpack_tables_request(data):
+    """
+    Client -> Server (38 bytes): Cookie(4), Type(1), Rounds per table(1), Tables(1), Name(31)
+    :return: (cookie, type, rounds, tables, team_name bytes), or None if the packet is incomplete
+    """
+    if not data or len(data) < REQUEST_LEN: return None
+    return TABLES_REQUEST.unpack_from(data)
+
+
+def pack_table_decision(table, decision):
+    """
+    Client -> Server (11 bytes): Cookie(4), Type(1), Table(1), Decision(5)
+    """
+    return TABLE_DECISION.pack(MAGIC_COOKIE, PAYLOAD_TYPE, table, decision)
+
+
+def unpack_table_decision(data, offset=0):
+    """
+    Client -> Server (11 bytes): Cookie(4), Type(1), Table(1), Decision(5)
+    :param offset: Where the packet starts in data
+    :return: (cookie, type, table, decision), all None if the packet is malformed
+    """
+    try:
+        return TABLE_DECISION.unpack_from(data, offset)
+    except struct.error:
+        return None, None, None, None
+
+
+def pack_table_payload_into(buffer, offset, table, result, rank=0, suit=0):
+    """
+    Server -> Client (10 bytes): Cookie(4), Type(1), Table(1), Result(1), Rank(2), Suit(1)
+    """
+    TABLE_PAYLOAD.pack_into(buffer, offset, MAGIC_COOKIE, PAYLOAD_TYPE, table, result, rank, suit)
+
+
+def unpack_table_payload(data, offset=0):
+    """
+    Server -> Client (10 bytes): Cookie(4), Type(1), Table(1), Result(1), Rank(2), Suit(1)
+    :param offset: Where the packet starts in data
+    :return: (table, result, rank, suit), or None if the packet is incomplete
+    """
+    if not data or len(data) < offset + TABLE_PAYLOAD_LEN: return None
+    return TABLE_PAYLOAD.unpack_from(data, offset)[2:]
+
+
+def pack_offer(tcp_port, server_name, load=None, capacity=0):
+    """
+    Server -> Client broadcast (39 bytes): Cookie(4), Type(1), Port(2), Name(32)
+    With a load, 4 more bytes follow: Load(2), Capacity(2)
+    :param load: Games being played, None for the plain 39-byte offer
+    :param capacity: Games the server plays at once, 0 for no limit
+    """
+    offer = OFFER.pack(MAGIC_COOKIE, OFFER_TYPE, tcp_port, pad_name(server_name))
+    if load is None:
+        return offer
+    return offer + LOAD.pack(min(load, 0xffff), min(capacity, 0xffff))
+
+
+def unpack_offer(data):
+    """
+    Server -> Client broadcast (39 bytes): Cookie(4), Type(1), Port(2), Name(32)
+    Extra trailing bytes are ignored.
+    :return: (cookie, type, port, server_name bytes), or None if the packet is incomplete
+    """
+    if len(data) < OFFER_LEN: return None
+    return OFFER.unpack_from(data)
+
+
+def unpack_offer_load(data):
+    """
+    :return: (load, capacity) of an offer, or None for a plain 39-byte offer
+    """
+    if len(data) < LOAD_OFFER_LEN: return None
+    return LOAD.unpack_from(data, OFFER_LEN)
+
+
+def pack_probe():
+    """
+    Client -> Server broadcast (5 bytes): Cookie(4), Type(1)
+    """
+    return PROBE.pack(MAGIC_COOKIE, PROBE_TYPE)
+
+
+def is_probe(data):
+    """
+    :return: True if a datagram is a discovery probe
+    """
+    return len(data) >= PROBE_LEN and PROBE.unpack_from(data) == (MAGIC_COOKIE, PROBE_TYPE)
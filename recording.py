@@ -0,0 +1,276 @@
+# Session recordings, for replaying real traffic against the server (see replay.py).
+# A recorded session is one game of a connection and holds everything the server needs to play
+# it again - the seeds of its shoes, the client's request and decisions with their timing - and
+# every byte the server sent, to check a replay against. The server's play is deterministic
+# given those, so a replay must produce the same bytes whatever the server implementation and
+# the timing. A kept-alive connection is recorded game by game, never buffered whole.
+# Each session is one record appended to the file: RECORD(magic, length) + zlib-compressed body,
+# so workers can share a file and a partly written file can be read up to its last whole record.
+# Sessions are compressed and written by a background thread, off the game threads; a session
+# that cannot be encoded or written is logged and skipped.
+import queue
+import struct
+import threading
+import time
+import zlib
+import background
+from cards import Shoe
+from constants import *
+from gamelog import logger
+import protocol
+
+RECORD = struct.Struct("!4sI")        # Magic, compressed body length
+RECORD_MAGIC = b"BJR3"
+# Body: HEADER, seeds, client messages, output
+HEADER = struct.Struct("!dBdIII")     # Start time, decks, penetration (-1 for none), shoes, messages, output length
+SEED = struct.Struct("!Q")
+MESSAGE = struct.Struct("!fB")        # Seconds since the previous client message, length, before each message
+
+
+class Session:
+    """
+    One recorded game: a connection's game, or one game of a kept-alive connection.
+    """
+    __slots__ = ("started", "decks", "penetration", "seeds", "messages", "output")
+
+    def __init__(self, started=0.0, decks=1, penetration=None):
+        self.started = started          # Unix time of the connection, or of the previous game's end
+        self.decks = decks
+        self.penetration = penetration  # Of the server's shoes, None to reshuffle every round
+        self.seeds = []                 # Seed of every shoe the session created, in order
+        self.messages = []              # (delay, packet) of every request and decision the client sent
+        self.output = bytearray()       # Every byte the server sent
+
+    @property
+    def requests(self):
+        """
+        :return: The requests of the session, one per game
+        """
+        return [packet for _, packet in self.messages if len(packet) == REQUEST_LEN]
+
+    @property
+    def rounds(self):
+        """
+        :return: Rounds the requests asked for, over all games and tables
+        """
+        rounds = 0
+        for request in self.requests:
+            if protocol.is_tables_request(request):
+                rounds += request[5] * request[6]
+            else:
+                rounds += request[5]
+        return rounds
+
+    def client_bytes(self):
+        """
+        :return: Every request and decision, as the client sent them
+        """
+        return b"".join(packet for _, packet in self.messages)
+
+    def shoe_factory(self):
+        """
+        :return: make_shoe for the server, creating the recorded shoes in order
+        """
+        seeds = iter(self.seeds)
+        return lambda: Shoe(self.decks, self.penetration, seed=next(seeds))
+
+    def encode(self):
+        penetration = -1.0 if self.penetration is None else self.penetration
+        parts = [HEADER.pack(self.started, self.decks, penetration, len(self.seeds), len(self.messages),
+                             len(self.output))]
+        parts.extend(SEED.pack(seed) for seed in self.seeds)
+        for delay, packet in self.messages:
+            parts.append(MESSAGE.pack(delay, len(packet)))
+            parts.append(packet)
+        parts.append(self.output)
+        body = zlib.compress(b"".join(parts))
+        return RECORD.pack(RECORD_MAGIC, len(body)) + body
+
+    @classmethod
+    def decode(cls, body):
+        data = zlib.decompress(body)
+        started, decks, penetration, shoes, messages, output_len = HEADER.unpack_from(data)
+        session = cls(started, decks, None if penetration < 0 else penetration)
+        offset = HEADER.size
+        session.seeds = [SEED.unpack_from(data, offset + i * SEED.size)[0] for i in range(shoes)]
+        offset += shoes * SEED.size
+        for _ in range(messages):
+            delay, size = MESSAGE.unpack_from(data, offset)
+            offset += MESSAGE.size
+            session.messages.append((delay, data[offset:offset + size]))
+            offset += size
+        session.output = data[offset:offset + output_len]
+        return session
+
+
+def read_sessions(path):
+    """
+    Yield the sessions of a recording file, in the order they were written.
+    Stops at the end of the last whole record.
+    """
+    with open(path, "rb") as f:
+        while True:
+            header = f.read(RECORD.size)
+            if len(header) < RECORD.size:
+                return
+            magic, length = RECORD.unpack(header)
+            if magic != RECORD_MAGIC:
+                raise ValueError(f"{path}: not a session recording")
+            body = f.read(length)
+            if len(body) < length:
+                return
+            yield Session.decode(body)
+
+
+class RecordingGame:
+    """
+    Wraps a game of a connection (BlackjackGame or MultiTableGame) for the server drivers:
+    the request, decisions and sent bytes go to the session, everything else goes to the game.
+    """
+
+    def __init__(self, game, recorder):
+        object.__setattr__(self, "game", game)
+        object.__setattr__(self, "recorder", recorder)
+
+    def __getattr__(self, name):
+        return getattr(self.game, name)
+
+    def __setattr__(self, name, value):
+        setattr(self.game, name, value)
+
+    def handshake(self, req_data):
+        self.recorder.message(req_data or b"")
+        return self.game.handshake(req_data)
+
+    def decide(self, data, offset=0):
+        self.recorder.message(data[offset:offset + self.game.decision_len])
+        self.game.decide(data, offset)
+
+    def flush(self, sendall):
+        output = self.recorder.session.output
+
+        def send(view):
+            output.extend(view)
+            sendall(view)
+
+        self.game.flush(send)
+
+
+class SessionRecorder:
+    """
+    Records one connection: the driver creates its shoes through shoe(), wraps each game
+    with wrap() once its request tells which kind of game it is, and calls save() at the end
+    of each game and once the connection is closed.
+    """
+
+    def __init__(self, recorder, make_shoe):
+        self.recorder = recorder
+        self.make_shoe = make_shoe
+        self.session = Session(time.time(), recorder.decks, recorder.penetration)
+        self.last = time.monotonic()  # Of the previous client message
+
+    def shoe(self):
+        shoe = self.make_shoe()
+        self.session.seeds.append(shoe.seed)
+        return shoe
+
+    def wrap(self, game):
+        return RecordingGame(game, self)
+
+    def message(self, packet):
+        now = time.monotonic()
+        self.session.messages.append((now - self.last, bytes(packet)))
+        self.last = now
+
+    def save(self):
+        """
+        Queue the game for writing, unless the connection ended before its request, and start
+        recording the next game of the connection.
+        """
+        if self.session.messages:
+            self.recorder.queue.put(self.session)
+        self.session = Session(time.time(), self.recorder.decks, self.recorder.penetration)
+
+
+class Recorder:
+    """
+    Appends the sessions of this process to a recording file from a background thread.
+    """
+
+    def __init__(self, path, decks=1, penetration=None):
+        self.path = path
+        self.decks = decks
+        self.penetration = penetration
+        self.queue = queue.SimpleQueue()
+        # Unbuffered: each batch is a single append, so workers sharing the file never interleave
+        self.file = open(path, "ab", buffering=0)
+        self.thread = threading.Thread(target=self._run, name="session-recorder", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            session = self.queue.get()
+            if session is None:
+                break
+            records = [self._encode(session)]
+            # Write whatever else is queued in the same call
+            while True:
+                try:
+                    session = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if session is None:
+                    self.queue.put(None)
+                    break
+                records.append(self._encode(session))
+            self._write(b"".join(records))
+        self.file.close()
+
+    def _encode(self, session):
+        try:
+            return session.encode()
+        except Exception:
+            logger.exception("Recording: failed to encode a session, it is skipped")
+            return b""
+
+    def _write(self, data):
+        view = memoryview(data)
+        try:
+            while view:
+                # Unbuffered, so a short write must be completed here
+                written = self.file.write(view)
+                view = view[written:]
+        except OSError:
+            logger.exception("Recording: failed to write %d bytes", len(view))
+
+    def close(self):
+        """
+        Write out the queued sessions and stop the thread.
+        """
+        self.queue.put(None)
+        self.thread.join()
+
+
+_recorder = background.Slot()
+
+
+def start(path, decks=1, penetration=None):
+    """
+    Record every session of this process to path from now on.
+    :param decks: Decks per shoe of the server
+    :param penetration: Penetration of the server's shoes
+    """
+    _recorder.start(Recorder(path, decks, penetration))
+
+
+def stop():
+    _recorder.stop()
+
+
+def session(make_shoe):
+    """
+    :param make_shoe: The driver's shoe factory
+    :return: SessionRecorder for a new connection, None when recording is off
+    """
+    recorder = _recorder.current
+    return None if recorder is None else SessionRecorder(recorder, make_shoe)
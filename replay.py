@@ -0,0 +1,168 @@
+# Replays recorded sessions (server.py --record FILE) against the server implementations, in
+# process over socket pairs: checks that every session gets byte-identical output and measures
+# how fast each implementation plays real traffic. The client side sends each session's requests
+# and decisions as fast as possible, or with the recorded think times with --paced.
+# Usage: python replay.py sessions.rec --modes threaded async --concurrency 64
+import argparse
+import asyncio
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import async_server
+import gamelog
+import server
+from recording import read_sessions
+
+SEND_INLINE = 64 * 1024  # Client bytes sent before reading the output, more are sent from a thread
+
+
+def send_paced(sock, session):
+    for delay, packet in session.messages:
+        time.sleep(delay)
+        sock.sendall(packet)
+    sock.shutdown(socket.SHUT_WR)
+
+
+def receive_all(sock):
+    output = bytearray()
+    while True:
+        data = sock.recv(65536)
+        if not data:
+            return bytes(output)
+        output += data
+
+
+def replay_threaded(session, paced=False):
+    """
+    Play one session through server.handle_client on a thread.
+    :return: The bytes the server sent
+    """
+    server_sock, client_sock = socket.socketpair()
+    game = threading.Thread(target=server.handle_client,
+                            args=(server_sock, ("replay", 0), session.shoe_factory()))
+    game.start()
+    sender = None
+    try:
+        data = session.client_bytes()
+        if paced or len(data) > SEND_INLINE:
+            # The output could fill the socket buffers before all decisions are sent
+            target = send_paced if paced else lambda sock, _: (sock.sendall(data), sock.shutdown(socket.SHUT_WR))
+            sender = threading.Thread(target=target, args=(client_sock, session))
+            sender.start()
+        else:
+            # The end of the input stands for the client hanging up, as in sessions cut short
+            client_sock.sendall(data)
+            client_sock.shutdown(socket.SHUT_WR)
+        return receive_all(client_sock)
+    finally:
+        if sender is not None:
+            sender.join()
+        game.join()
+        client_sock.close()
+
+
+async def replay_async(session, paced=False):
+    """
+    Play one session through async_server.handle_client_async on the running loop.
+    :return: The bytes the server sent
+    """
+    server_sock, client_sock = socket.socketpair()
+    reader, writer = await asyncio.open_connection(sock=server_sock)
+    game = asyncio.create_task(async_server.handle_client_async(reader, writer, session.shoe_factory()))
+    client_reader, client_writer = await asyncio.open_connection(sock=client_sock)
+
+    async def send():
+        if paced:
+            for delay, packet in session.messages:
+                await asyncio.sleep(delay)
+                client_writer.write(packet)
+        else:
+            client_writer.write(session.client_bytes())
+        await client_writer.drain()
+        client_writer.write_eof()
+
+    sender = asyncio.create_task(send())
+    try:
+        return await client_reader.read()
+    finally:
+        await sender
+        await game
+        client_writer.close()
+
+
+def run_threaded(sessions, concurrency, paced):
+    with ThreadPoolExecutor(concurrency) as pool:
+        return list(pool.map(lambda session: replay_threaded(session, paced), sessions))
+
+
+async def run_async(sessions, concurrency, paced):
+    slots = asyncio.Semaphore(concurrency)
+
+    async def one(session):
+        async with slots:
+            return await replay_async(session, paced)
+
+    return await asyncio.gather(*(one(session) for session in sessions))
+
+
+def first_difference(expected, actual):
+    for i, (a, b) in enumerate(zip(expected, actual)):
+        if a != b:
+            return i
+    return min(len(expected), len(actual))
+
+
+def replay(sessions, mode, concurrency=64, paced=False):
+    """
+    Replay every session with one server implementation.
+    :param mode: "threaded" or "async"
+    :return: Report dict: sessions, rounds, bytes, seconds, rates, and the indexes of the
+             sessions whose output differed from the recording
+    """
+    start = time.perf_counter()
+    if mode == "threaded":
+        outputs = run_threaded(sessions, concurrency, paced)
+    else:
+        outputs = asyncio.run(run_async(sessions, concurrency, paced))
+    elapsed = time.perf_counter() - start
+
+    mismatches = [i for i, (session, output) in enumerate(zip(sessions, outputs)) if output != session.output]
+    for i in mismatches[:3]:
+        offset = first_difference(sessions[i].output, outputs[i])
+        print(f"  session {i}: output differs at byte {offset} "
+              f"({len(outputs[i])} bytes, recorded {len(sessions[i].output)})")
+    rounds = sum(session.rounds for session in sessions)
+    sent = sum(len(output) for output in outputs)
+    return {
+        "mode": mode,
+        "sessions": len(sessions),
+        "rounds": rounds,
+        "bytes": sent,
+        "seconds": elapsed,
+        "sessions_per_sec": len(sessions) / elapsed,
+        "rounds_per_sec": rounds / elapsed,
+        "mismatches": mismatches,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay recorded sessions against the server")
+    parser.add_argument("recording", help="file written by server.py --record")
+    parser.add_argument("--modes", nargs="+", choices=["threaded", "async"], default=["threaded", "async"])
+    parser.add_argument("--concurrency", type=int, default=64, help="sessions replayed at once")
+    parser.add_argument("--repeat", type=int, default=1, help="replay the recording this many times")
+    parser.add_argument("--paced", action="store_true", help="wait the recorded think time before each decision")
+    args = parser.parse_args()
+
+    gamelog.configure("ERROR")
+    sessions = list(read_sessions(args.recording)) * args.repeat
+    print(f"{len(sessions)} sessions, {sum(session.rounds for session in sessions)} rounds\n")
+    print(f"{'mode':<10}{'sessions/s':>12}{'rounds/s':>12}{'MB/s':>8}{'mismatches':>12}")
+    failed = False
+    for mode in args.modes:
+        r = replay(sessions, mode, args.concurrency, args.paced)
+        failed |= bool(r["mismatches"])
+        print(f"{r['mode']:<10}{r['sessions_per_sec']:>12.1f}{r['rounds_per_sec']:>12.1f}"
+              f"{r['bytes'] / r['seconds'] / 1e6:>8.2f}{len(r['mismatches']):>12}")
+    raise SystemExit(1 if failed else 0)
@@ -1,287 +1,951 @@
+import argparse
+import asyncio
+import functools
+import logging
+import signal
 import socket
-import struct
 import threading
 import time
-import random
+from cards import BLACKJACK, CARDS, DEALER_STANDS_ON, Hand, PregeneratedShuffles, RANKS, SUITS, Shoe, VALUES, settle
 from constants import *
+import discovery
+from framing import MessageReader
+import metrics
+import gamelog
+from gamelog import logger
+import history
+import leaderboard
+import protocol
+import recording
+import strategy
+import timers
+from protocol import HIT_DECISION, HIT_PACKET, STAND_DECISION, STAND_PACKET, unpack_client_payload
 
 # --- Constants ---
 SERVER_NAME_LEN = 32
-
-SUITS = ["Heart", "Diamond", "Clubs", "Spades"]
-
-class Card:
-    def __init__(self, rank, suit):
-        self.__rank = int(rank)
-        self.__suit = int(suit)
-
-    def get_rank(self):
-        # Ace is 11, Face cards are 10
-        if self.__rank >= 11: return 10
-        return self.__rank
-
-    def send_rank(self):
-        return self.__rank
-
-    def get_suit(self):
-        return self.__suit
-
-    def __str__(self):
-        r_str = {1: 'Ace', 11: 'Jack', 12: 'Queen', 13: 'King'}.get(self.__rank, str(self.__rank))
-        return f"{r_str} of {get_suit_char(self.__suit)}"
-
-def calculate_hand_value(cards):
+# Payloads buffered between two client decisions: result + next deal (4) plus the dealer's
+# reveal and draws - the dealer draws at most 15 cards before reaching 17.
+OUT_BUFFER_PAYLOADS = 24
+HANDSHAKE_TIMEOUT = 10  # Seconds to wait for the request
+CLIENT_TIMEOUT = 90  # Seconds to wait for each decision
+IDLE_TIMEOUT = 30  # Seconds a kept-alive connection waits for its next request
+DEFAULT_BACKLOG = 5
+DRAIN_TIMEOUT = 10  # Seconds running games get to finish when the server shuts down
+MAX_TABLES = 64  # Tables a multi-table session may open
+
+
+class BlackjackGame:
     """
-    Calculate the total value of a hand based on card ranks.
+    Round logic of a single game, independent of the transport.
+    The threaded and the asyncio servers both drive it: they feed it the request and the
+    client decisions, and flush the payloads it buffers back to the client.
+    All payloads produced between two client decisions (e.g. a round's result and the next
+    round's deal) are packed into one preallocated buffer and sent with a single call.
     """
-    total = 0
-    aces = 0
-    for card in cards:
-        rank = card.get_rank()
-        if rank == 1:
-            aces += 1
-            total += 11
+
+    def __init__(self, addr, shoe=None, table=None):
+        self.addr = addr
+        # Table id in a multi-table session (see MultiTableGame), None for a one-game connection
+        self.table = table
+        self.payload_len = PAYLOAD_LEN if table is None else TABLE_PAYLOAD_LEN
+        self.decision_len = DECISION_LEN if table is None else TABLE_DECISION_LEN
+        self.team_name = "Unknown"  # Label in logs and events, with the table id in a multi-table session
+        self.team = "Unknown"       # Team the results count for, on the leaderboard and in the history
+        self.num_rounds = 0
+        self.round_num = 0
+        self.total_wins = 0
+        self.total_losses = 0
+        self.round_over = True
+        # Seeded per connection, see cards.Shoe
+        self.shoe = shoe if shoe is not None else Shoe()
+        self.player_hand = Hand()
+        self.dealer_hand = Hand()
+        # Outgoing payloads, flushed once per game step
+        self.out = bytearray(OUT_BUFFER_PAYLOADS * self.payload_len)
+        self.out_len = 0
+        # Send and receive system calls and bytes of this game (the asyncio server only counts
+        # sends, its reads are done by the event loop)
+        self.send_calls = 0
+        self.recv_calls = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        # Per-round metrics are observed on the flush after a round ends
+        self.rounds_completed = 0
+        self.rounds_reported = 0
+        self.round_mark = (0, 0)  # (syscalls, bytes) when the last reported round ended
+        self.decided_at = 0.0
+        self.started = False
+        self.keep_alive = False  # The request asked to keep the connection for another game
+        # Checked once per game, so nothing is built for the event log when it is off
+        self.events = gamelog.events_enabled()
+        # Basic-strategy tables when the server reports expected values (--report-ev), else None
+        self.strategy = strategy.loaded()
+        self.round_ev = 0.0
+        self.expected = 0.0  # Sum of the rounds' EV, in bets
+        # Finished games go to the history database when it is on (--history)
+        self.history = history.writer()
+        self.history_rounds = []
+        self.leaderboard = leaderboard.board()  # Live per-team results when on (--leaderboard)
+        self.started_at = 0.0
+
+    def log(self, message, *args, level=logging.INFO):
+        """
+        Log a message about this game. The %-style args are only formatted if the level is
+        enabled, and then by the log writer thread (see gamelog).
+        """
+        if logger.isEnabledFor(level):
+            logger.log(level, message, *args,
+                       extra={"team": self.team_name, "round": self.round_num, "client": self.addr})
+
+    def debug(self, message, *args):
+        if logger.isEnabledFor(logging.DEBUG):
+            self.log(message, *args, level=logging.DEBUG)
+
+    def warning(self, message, *args):
+        self.log(message, *args, level=logging.WARNING)
+
+    def handshake(self, req_data):
+        """
+        Validate the client request and set up the game.
+        :param req_data: Request packet - Cookie(4), Type(1), Rounds(1), Name(32) = 38 bytes
+        :return: True if the game can start, False otherwise
+        """
+        if not req_data or len(req_data) < REQUEST_LEN:
+            self.warning("Error During Handshake - Corrupted data")
+            metrics.HANDSHAKE_FAILURES.inc()
+            return False
+
+        self.bytes_received += REQUEST_LEN
+        cookie, mtype, num_rounds, team_name_b = protocol.unpack_request(req_data)
+        self.keep_alive = bool(mtype & KEEP_ALIVE)
+        if cookie != MAGIC_COOKIE or mtype & ~KEEP_ALIVE != REQUEST_TYPE:
+            self.warning("Error During Handshake - Invalid cookie or type")
+            metrics.HANDSHAKE_FAILURES.inc()
+            return False
+
+        self.begin(protocol.unpad_name(team_name_b), num_rounds)
+        return True
+
+    def begin(self, team_name, num_rounds, team=None):
+        """
+        Start the game after a valid request.
+        :param team: Team of the results, defaults to team_name
+        """
+        self.team_name = team_name
+        self.team = team_name if team is None else team
+        self.num_rounds = num_rounds
+        self.log("Game starting with %s for %d rounds.", self.team_name, num_rounds)
+        self.started = True
+        self.started_at = time.time()
+        metrics.GAMES.inc()
+        metrics.ACTIVE_GAMES.inc()
+        if self.events:
+            gamelog.event("game_start", team=self.team_name, rounds=num_rounds,
+                          client=str(self.addr), seed=self.shoe.seed)
+
+    @property
+    def finished(self):
+        return self.round_over and self.round_num >= self.num_rounds
+
+    @property
+    def syscalls(self):
+        return self.send_calls + self.recv_calls
+
+    def close(self):
+        """
+        Called by the driver once the connection is closed.
+        """
+        if self.started:
+            self.started = False
+            metrics.ACTIVE_GAMES.dec()
+
+    def send(self, result, card=None):
+        """
+        Buffer one payload until the next flush.
+        """
+        if self.out_len + self.payload_len > len(self.out):
+            self.out.extend(bytes(len(self.out)))
+        if self.table is None:
+            # Copied from the prebuilt payloads, card ints are their indexes (see protocol.card_index)
+            payload = protocol.RESULT_PAYLOADS[result] if card is None else protocol.CARD_PAYLOADS[result][card]
+            self.out[self.out_len:self.out_len + PAYLOAD_LEN] = payload
+        elif card is None:
+            protocol.pack_table_payload_into(self.out, self.out_len, self.table, result)
         else:
-            total += rank
-    # Adjust for aces if bust
-    while total > 21 and aces > 0:
-        total -= 10
-        aces -= 1
-    return total
-
-def create_deck():
-    # Suit: 0-3, Rank: 1-13
-    deck = [Card(r, s) for s in range(4) for r in range(1, 14)]
-    random.shuffle(deck)
-    return deck
-
-def pack_server_payload(result, card=None):
-    """
-    Server -> Client Packet Structure (9 bytes):
-    Magic Cookie (4), Type (1), Result (1), Rank (2), Suit (1)
-    """
-    rank = card.send_rank() if card else 0
-    suit = card.get_suit() if card else 0
-    # ! = Network (Big Endian), I = Int(4), B = Char(1), B = Char(1), H = Short(2), B = Char(1)
-    return struct.pack("!IBBHB", MAGIC_COOKIE, PAYLOAD_TYPE, result, rank, suit)
+            protocol.pack_table_payload_into(self.out, self.out_len, self.table, result,
+                                             RANKS[card], SUITS[card])
+        self.out_len += self.payload_len
+
+    def flush(self, sendall):
+        """
+        Send all buffered payloads with a single call.
+        :param sendall: Blocking send function, it must not keep a reference to the data
+        """
+        if not self.out_len:
+            return
+        with memoryview(self.out)[:self.out_len] as view:
+            sendall(view)
+        self.bytes_sent += self.out_len
+        self.out_len = 0
+        self.send_calls += 1
+
+        if self.decided_at:
+            metrics.DECISION_LATENCY.observe(time.perf_counter() - self.decided_at)
+            self.decided_at = 0.0
+        if self.rounds_completed != self.rounds_reported:
+            self.report_round()
+
+    def report_round(self):
+        syscalls, total_bytes = self.syscalls, self.bytes_sent + self.bytes_received
+        rounds = self.rounds_completed - self.rounds_reported
+        metrics.SYSCALLS_PER_ROUND.observe((syscalls - self.round_mark[0]) / rounds)
+        metrics.BYTES_PER_ROUND.observe((total_bytes - self.round_mark[1]) / rounds)
+        self.round_mark = (syscalls, total_bytes)
+        self.rounds_reported = self.rounds_completed
+
+    def start(self):
+        """
+        Deal the first round, if the game has any.
+        """
+        if not self.finished:
+            self.start_round()
+
+    def start_round(self):
+        """
+        Shuffle the shoe if needed and deal the initial cards: the player's two cards and the
+        dealer's visible card.
+        """
+        self.round_num += 1
+        self.round_over = False
+        logger.debug("             --- Start Round %d ---", self.round_num)
+        self.shoe.start_round()
+        draw = self.shoe.draw
+
+        # Deal initial cards
+        # Player gets 2 cards
+        card1 = draw()
+        card2 = draw()
+        self.player_hand = Hand(card1, card2)
+
+        # Dealer gets 2 cards (one hidden)
+        d_card1 = draw()  # Visible
+        d_card2 = draw()  # Hidden
+        self.dealer_hand = Hand(d_card1, d_card2)
+        if self.strategy is not None:
+            # What the round is worth to a basic-strategy player, a table lookup
+            hand = self.player_hand
+            self.round_ev = self.strategy.expected_value(hand.total, hand.soft > 0, VALUES[d_card1])
+            self.expected += self.round_ev
+
+        self.debug("Dealt: %s, %s", CARDS[card1], CARDS[card2])
+        self.debug("Dealer dealt: %s [Hidden]\n", CARDS[d_card1])
+
+        # Send Player's cards, then the Dealer's FIRST card only
+        self.send(ROUND_NOT_OVER, card1)
+        self.send(ROUND_NOT_OVER, card2)
+        self.send(ROUND_NOT_OVER, d_card1)
+
+    def decide(self, data, offset=0):
+        """
+        Apply one client decision to the current round, and deal the next round once this
+        one is over.
+        :param data: bytes or bytearray holding the decision packet - Cookie(4), Type(1), Decision(5) = 10 bytes
+        :param offset: Where the packet starts in data
+        """
+        # The two valid packets are matched as raw bytes in place, nothing is unpacked or decoded
+        if data.startswith(HIT_PACKET, offset):
+            decision = HIT_DECISION
+        elif data.startswith(STAND_PACKET, offset):
+            decision = STAND_DECISION
+        else:
+            # Parse decision
+            cookie, _, decision = unpack_client_payload(data, offset)
+            # Validate cookie, if invalid, ignore and continue
+            if cookie != MAGIC_COOKIE: return
+        self.play(decision)
+
+    def play(self, decision):
+        """
+        Apply a decision that was already taken out of its packet.
+        :param decision: HIT_DECISION or STAND_DECISION, other bytes are ignored
+        """
+        self.decided_at = time.perf_counter()
+        self.bytes_received += self.decision_len
+
+        if decision == HIT_DECISION:
+            self.debug("Chose to: Hittt")
+            self.hit()
+
+        elif decision == STAND_DECISION:
+            self.debug("Chose to: Stand")
+            self.dealer_turn()
 
-def unpack_client_payload(data):
+        else:
+            plan = protocol.unpack_plan(decision)
+            if plan is not None:
+                self.play_plan(*plan)
+
+        if self.round_over:
+            self.rounds_completed += 1
+            metrics.ROUNDS.inc()
+            if not self.finished:
+                self.start_round()
+
+    def hit(self):
+        """
+        Deal the player a card, ending the round if it busts the hand.
+        """
+        new_card = self.shoe.draw()
+        self.debug("Drew: %s\n", CARDS[new_card])
+
+        # Check value immediately
+        p_val = self.player_hand.add(new_card)
+
+        if p_val > BLACKJACK:
+            self.debug("BUSTED with value %d!", p_val)
+            # BUST! Send the card AND the Loss result together
+            self.send(LOSS, new_card)
+            self.round_over = True
+            self.total_losses += 1
+            self.end_round(LOSS)
+        else:
+            # Safe hit
+            self.send(ROUND_NOT_OVER, new_card)
+
+    def play_plan(self, hard, soft):
+        """
+        Play the rest of the player's turn from a decision plan: hit while the hand is below
+        the stand total for its kind, then stand. The client gets the same payloads as for
+        one decision at a time, in a single flush.
+        :param hard: Stand total of hard hands
+        :param soft: Stand total of soft hands (an ace counted as 11)
+        """
+        self.debug("Chose to: play a plan, stand on hard %d, soft %d", hard, soft)
+        hand = self.player_hand
+        while not self.round_over and hand.total < (soft if hand.soft else hard):
+            self.hit()
+        if not self.round_over:
+            self.dealer_turn()
+
+    def dealer_turn(self):
+        """
+        Play the dealer's hand after the player stands and settle the round: sends the
+        hidden card, the dealer's draws and the final result.
+        """
+        self.round_over = True
+        dealer_hand = self.dealer_hand
+        d_card2 = dealer_hand.cards[1]
+        # Reveal hidden card (Send it to client)
+        # Note: Protocol doesn't have "Reveal" type, so we send it as a card update
+        self.debug("Dealer reveals hidden card: %s", CARDS[d_card2])
+        self.send(ROUND_NOT_OVER, d_card2)
+
+        # Dealer logic: Hit until >= 17
+        while dealer_hand.total < DEALER_STANDS_ON:
+            new_card = self.shoe.draw()
+            dealer_hand.add(new_card)
+            self.debug("Dealer draws: %s\n", CARDS[new_card])
+            self.send(ROUND_NOT_OVER, new_card)
+
+        # Calculate Winner
+        p_sum = self.player_hand.total
+        d_sum = dealer_hand.total
+        self.debug("Player final value: %d  |  Dealer final value: %d", p_sum, d_sum)
+
+        result = settle(p_sum, d_sum)
+
+        # Send Final Result (No card attached)
+        self.send(result, None)
+        if result == WIN:
+            self.debug("Player WINS the round!")
+            self.total_wins += 1
+        if result == TIE:
+            self.debug("Round is a TIE.")
+        if result == LOSS:
+            self.debug("Player LOSES the round.")
+            self.total_losses += 1
+        self.end_round(result)
+
+    def end_round(self, result):
+        """
+        Pass a settled round to the event log, the history and the leaderboard, those that are on.
+        """
+        if self.events:
+            self.round_event(result)
+        if self.history is not None:
+            self.history_rounds.append((self.round_num, bytes(self.player_hand.cards),
+                                        bytes(self.dealer_hand.cards), result))
+        if self.leaderboard is not None:
+            self.leaderboard.record(self.team, result)
+
+    def round_event(self, result):
+        extra = {} if self.strategy is None else {"ev": round(self.round_ev, 4)}
+        gamelog.event("round", team=self.team_name, round=self.round_num,
+                      player=list(self.player_hand.cards), dealer=list(self.dealer_hand.cards), result=result,
+                      **extra)
+
+    def game_over(self):
+        per_round = self.syscalls / self.num_rounds if self.num_rounds else 0
+        self.log("Game over. Total Wins: %d out of %d (%.1f syscalls per round)\n",
+                 self.total_wins, self.num_rounds, per_round)
+        extra = {}
+        if self.strategy is not None:
+            net = self.total_wins - self.total_losses
+            self.log("Net result %+d bets, basic strategy expects %+.2f", net, self.expected)
+            extra = {"net": net, "expected": round(self.expected, 4)}
+        if self.history is not None:
+            ties = self.num_rounds - self.total_wins - self.total_losses
+            self.history.record(self.team, self.started_at, time.time(), self.total_wins, ties,
+                                self.total_losses, self.history_rounds)
+        if self.events:
+            gamelog.event("game_end", team=self.team_name, rounds=self.num_rounds, wins=self.total_wins,
+                          **extra)
+
+
+class MultiTableGame:
     """
-    Client -> Server Packet Structure (10 bytes):
-    Magic Cookie (4), Type (1), Decision (5 bytes string)
+    Several games played concurrently over one connection, for clients that would otherwise
+    open a connection per game. The client opts in with a TABLES_REQUEST_TYPE request; every
+    table is then a BlackjackGame with its own shoe, and payloads and decisions carry the
+    table id so the client can interleave its decisions for the different tables.
+    Drivers use it through the same methods as a BlackjackGame.
     """
-    try:
-        cookie, mtype, decision = struct.unpack("!IB5s", data)
-        return cookie, mtype, decision
-    except struct.error:
-        return None, None, None
-
-def handle_client(conn, addr):
-    team_name = "Unknown"
-    round_num = 0
-
-    def game_log(message):
-        if round_num:
-            log = f"[Team: {team_name}, Round: {round_num}]"
-            print(f"{Colors.RED}{log}{Colors.RESET} {message}")
+    decision_len = TABLE_DECISION_LEN
+
+    def __init__(self, game, make_shoe):
+        """
+        :param game: The connection's BlackjackGame, its shoe is reused by table 0
+        :param make_shoe: Creates the shoes of the other tables
+        """
+        self.game = game
+        self.make_shoe = make_shoe
+        self.tables = []
+        self.playing = 0  # Tables that have rounds left
+        self.dirty = []   # Tables with payloads waiting for the next flush
+        self.recv_calls = 0  # Set by the driver, credited to the table each decision is for
+        self.recv_seen = 0
+        self.keep_alive = False
+
+    def log(self, message, *args, level=logging.INFO):
+        self.game.log(message, *args, level=level)
+
+    def warning(self, message, *args):
+        self.game.warning(message, *args)
+
+    def handshake(self, req_data):
+        """
+        Validate a multi-table request and set up one game per table.
+        :param req_data: Cookie(4), Type(1), Rounds per table(1), Tables(1), Name(31) = 38 bytes
+        :return: True if the games can start, False otherwise
+        """
+        request = protocol.unpack_tables_request(req_data)
+        if request is None:
+            self.warning("Error During Handshake - Corrupted data")
+            metrics.HANDSHAKE_FAILURES.inc()
+            return False
+        cookie, mtype, num_rounds, num_tables, team_name_b = request
+        self.keep_alive = bool(mtype & KEEP_ALIVE)
+        if cookie != MAGIC_COOKIE or mtype & ~KEEP_ALIVE != TABLES_REQUEST_TYPE or not 0 < num_tables <= MAX_TABLES:
+            self.warning("Error During Handshake - Invalid cookie, type or table count")
+            metrics.HANDSHAKE_FAILURES.inc()
+            return False
+
+        team_name = protocol.unpad_name(team_name_b)
+        self.log("Multi-table session with %s: %d tables of %d rounds.", team_name, num_tables, num_rounds)
+        for table in range(num_tables):
+            shoe = self.game.shoe if table == 0 else self.make_shoe()
+            game = BlackjackGame(self.game.addr, shoe, table)
+            game.begin(f"{team_name}#{table}", num_rounds, team_name)
+            self.tables.append(game)
+        self.playing = num_tables if num_rounds else 0
+        return True
+
+    @property
+    def finished(self):
+        return not self.playing
+
+    def start(self):
+        for game in self.tables:
+            game.start()
+        self.dirty.extend(self.tables)
+
+    def decide(self, data, offset=0):
+        """
+        Apply one decision to its table. Decisions for unknown or finished tables are ignored.
+        :param data: bytes or bytearray holding Cookie(4), Type(1), Table(1), Decision(5) = 11 bytes
+        :param offset: Where the packet starts in data
+        """
+        table = data[offset + 5]
+        if table >= len(self.tables): return
+        if data.startswith(protocol.TABLE_HIT_PACKETS[table], offset):
+            decision = HIT_DECISION
+        elif data.startswith(protocol.TABLE_STAND_PACKETS[table], offset):
+            decision = STAND_DECISION
         else:
-            print(f"[Client {addr}] {message}")
-
-    game_log(f"Client connected from {addr}")
-
-    conn.settimeout(90)
-    try:
+            cookie, _, table, decision = protocol.unpack_table_decision(data, offset)
+            if cookie != MAGIC_COOKIE: return
+        game = self.tables[table]
+        if game.finished: return
+
+        game.recv_calls += self.recv_calls - self.recv_seen
+        self.recv_seen = self.recv_calls
+        game.play(decision)
+        self.dirty.append(game)
+        if game.finished:
+            self.playing -= 1
+
+    def flush(self, sendall):
+        """
+        Send the payloads of every table that has some with a single call.
+        """
+        if len(self.dirty) == 1:
+            self.dirty[0].flush(sendall)
+        elif self.dirty:
+            chunks = []
+
+            def collect(view):
+                chunks.append(bytes(view))
+
+            for game in self.dirty:
+                game.flush(collect)
+            sendall(b"".join(chunks))
+        self.dirty.clear()
+
+    def game_over(self):
+        for game in self.tables:
+            game.game_over()
+
+    def close(self):
+        for game in self.tables:
+            game.close()
+
+
+def handle_client(conn, addr, make_shoe=Shoe, handshake_timeout=HANDSHAKE_TIMEOUT,
+                  decision_timeout=CLIENT_TIMEOUT, wheel=None, idle_timeout=IDLE_TIMEOUT):
+    """
+    Threaded server: plays a whole game on a blocking socket, then more games on the same
+    connection while the client's requests ask to keep it alive.
+    :param make_shoe: Creates the connection's shoe
+    :param handshake_timeout: Seconds the client has to send its request
+    :param decision_timeout: Seconds the client has for each decision, idle games are reclaimed after it
+    :param wheel: timers.TimerWheel enforcing the deadlines, the process's shared wheel by default
+    :param idle_timeout: Seconds a kept-alive connection waits for its next request
+    """
+    session = recording.session(make_shoe)  # None unless the server records sessions (--record)
+    if session is not None:
+        make_shoe = session.shoe
+    game = BlackjackGame(addr, make_shoe())
+    game.log("Client connected from %s", addr)
+    metrics.ACTIVE_CONNECTIONS.inc()
+
+    wheel = wheel or timers.shared_wheel()
+    expired = False
+
+    def cut_off():
+        nonlocal expired
+        expired = True
         try:
+            # Wakes up the game thread blocked in recv() or sendall()
+            conn.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    deadline = wheel.schedule(handshake_timeout, cut_off)
+    reader = MessageReader(conn)
+    kept_alive = False  # Waiting for the next request of a kept-alive connection
+    try:
+        while True:
             # Receive Request (Header + Name)
             # Cookie(4), Type(1), Rounds(1), Name(32) = 38 bytes
-            req_data = conn.recv(38)
-        except socket.timeout:
-            game_log("Timeout waiting for handshake data.")
-            return
-        if not req_data or len(req_data) < 38:
-            game_log("Error During Handshake - Corrupted data")
-            return
-
-        cookie, mtype, num_rounds, team_name_b = struct.unpack("!IBB32s", req_data)
-        if cookie != MAGIC_COOKIE or mtype != REQUEST_TYPE:
-            game_log("Error During Handshake - Invalid cookie or type")
-            return
-
-        team_name = team_name_b.decode('utf-8').strip('\x00')
-        game_log(f"Game starting with {team_name} for {num_rounds} rounds.")
-
-        total_wins = 0
-        # Game Loop
-        for round_num in range(1, num_rounds + 1):
-            print(f"             --- Start Round {round_num} ---")
-            deck = create_deck()
-            player_hand = []
-            dealer_hand = []
-
-            # Deal initial cards
-            # Player gets 2 cards
-            card1 = deck.pop()
-            card2 = deck.pop()
-            player_hand.extend([card1, card2])
-
-            # Dealer gets 2 cards (one hidden)
-            d_card1 = deck.pop()  # Visible
-            d_card2 = deck.pop()  # Hidden
-            dealer_hand.extend([d_card1, d_card2])
-
-            game_log(f"Dealt: {card1}, {card2}")
-            game_log(f"Dealer dealt: {d_card1} [Hidden]\n")
+            req_data = reader.read(REQUEST_LEN)
+            if kept_alive:
+                if expired:
+                    game.log("Kept-alive connection idle for %gs, closing it.", idle_timeout)
+                    metrics.IDLE_TIMEOUTS.inc()
+                    return
+                if req_data is None:
+                    return  # The client is done with the connection
+                metrics.KEEP_ALIVE_GAMES.inc()
+            elif expired:
+                game.warning("Timeout waiting for handshake data.")
+                metrics.HANDSHAKE_TIMEOUTS.inc()
+                return
+            if protocol.is_tables_request(req_data):
+                game = MultiTableGame(game, make_shoe)
+            if session is not None:
+                game = session.wrap(game)
+            if not game.handshake(req_data):
+                return
 
             # Send initial cards to client
+            wheel.reschedule(deadline, decision_timeout)
             try:
-                # Send Player's cards
-                conn.sendall(pack_server_payload(ROUND_NOT_OVER, card1))
-                conn.sendall(pack_server_payload(ROUND_NOT_OVER, card2))
-                # Send Dealer's FIRST card only
-                conn.sendall(pack_server_payload(ROUND_NOT_OVER, d_card1))
+                game.start()
+                game.flush(conn.sendall)
             except socket.error as e:
-                game_log(f"Error sending initial cards: {e}")
+                game.warning("Error sending initial cards: %s", e)
                 return
 
-            # --- Player's Turn ---
-            player_busted = False
-            while True:
-                try:
-                    # Wait for player decision
-                    data = conn.recv(10)
-                except socket.timeout:
-                    game_log(f"Timeout waiting for decision.")
-                    return
-
-                if not data:
-                    game_log(f"Connection lost.")
+            # Game Loop: each decision gets all of its payloads in one send
+            while not game.finished:
+                # Wait for player decision, received into the reader's buffer
+                offset = reader.read_offset(game.decision_len)
+                if offset < 0:
+                    if expired:
+                        game.warning("Timeout waiting for decision, game reclaimed.")
+                        metrics.DECISION_TIMEOUTS.inc()
+                    else:
+                        game.warning("Connection lost.")
                     return
 
-                # Parse decision
-                cookie, _, decision_bytes = unpack_client_payload(data)
-                # Validate cookie, if invalid, ignore and continue
-                if cookie != MAGIC_COOKIE: continue
-
-                decision = decision_bytes.decode('utf-8')
-                game_log(f"Chose to: {decision}")
-
-                if decision == "Hittt":
-                    new_card = deck.pop()
-                    player_hand.append(new_card)
-                    game_log(f"Drew: {new_card}\n")
+                wheel.reschedule(deadline, decision_timeout)
+                game.recv_calls = reader.recv_calls
+                game.decide(reader.buffer, offset)
+                game.flush(conn.sendall)
+            game.game_over()
+            if session is not None:
+                session.save()  # A record per game, a kept-alive connection is not held in memory
+            if not game.keep_alive:
+                return
 
-                    # Check value immediately
-                    p_val = calculate_hand_value(player_hand)
-
-                    if p_val > 21:
-                        game_log(f"BUSTED with value {p_val}!")
-                        # BUST! Send the card AND the Loss result together
-                        conn.sendall(pack_server_payload(LOSS, new_card))
-                        player_busted = True
-                        break  # End player turn
-                    else:
-                        # Safe hit
-                        conn.sendall(pack_server_payload(ROUND_NOT_OVER, new_card))
-
-                elif decision == "Stand":
-                    break
-
-            result = LOSS  # Default result if player busted
-            # --- Dealer's Turn (only if player didn't bust) ---
-            if not player_busted:
-                # Reveal hidden card (Send it to client)
-                # Note: Protocol doesn't have "Reveal" type, so we send it as a card update
-                game_log(f"Dealer reveals hidden card: {d_card2}")
-                conn.sendall(pack_server_payload(ROUND_NOT_OVER, d_card2))
-
-                # Dealer logic: Hit until >= 17
-                while calculate_hand_value(dealer_hand) < 17:
-                    new_card = deck.pop()
-                    dealer_hand.append(new_card)
-                    game_log(f"Dealer draws: {new_card}\n")
-                    conn.sendall(pack_server_payload(ROUND_NOT_OVER, new_card))
-
-                # Calculate Winner
-                p_sum = calculate_hand_value(player_hand)
-                d_sum = calculate_hand_value(dealer_hand)
-                game_log(f"Player final value: {p_sum}  |  Dealer final value: {d_sum}")
-
-                if d_sum > 21:  # Dealer bust
-                    result = WIN
-                elif p_sum > d_sum:
-                    result = WIN
-                elif p_sum == d_sum:
-                    result = TIE
-
-                # Send Final Result (No card attached)
-                conn.sendall(pack_server_payload(result, None))
-                if result == WIN:
-                    game_log(f"Player WINS the round!")
-                    total_wins += 1
-                if result == TIE:
-                    game_log(f"Round is a TIE.")
-                if result == LOSS:
-                    game_log(f"Player LOSES the round.")
-        game_log(f"Game over. Total Wins: {total_wins} out of {num_rounds}\n")
+            # Same connection, next game: the client has idle_timeout to send its request
+            wheel.reschedule(deadline, idle_timeout)
+            game.close()
+            game = BlackjackGame(addr, make_shoe())
+            reader.recv_calls = 0
+            kept_alive = True
 
     except Exception as e:
-        game_log(f"Error handling client {addr}: {e}")
+        game.warning("Error handling client %s: %s", addr, e)
     finally:
+        wheel.cancel(deadline)
         conn.close()
-        game_log(f"Client {addr} closed.")
-
+        game.close()
+        if session is not None:
+            session.save()
+        metrics.ACTIVE_CONNECTIONS.dec()
+        game.log("Client %s closed.", addr)
 
-def udp_broadcast(tcp_port):
-    """ Broadcasts offer every 1 second """
-    udp_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
-    udp_sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
 
-    # Pad name to 32 bytes
-    server_name = "BlackjackServer".encode('utf-8')
-    server_name += b'\x00' * (32 - len(server_name))
+def reject(conn, addr):
+    """
+    Turn a connection away with a BUSY payload, without waiting on the client.
+    """
+    metrics.REJECTED.inc()
+    logger.info("Server full, rejected %s.", addr)
+    try:
+        conn.setblocking(False)
+        conn.send(protocol.BUSY_PAYLOAD)
+        # Read the request if it is already here: closing with unread data resets the
+        # connection, and the client could lose the BUSY payload
+        conn.recv(REQUEST_LEN)
+        conn.shutdown(socket.SHUT_WR)
+    except OSError:
+        pass
+    finally:
+        conn.close()
 
-    # Offer: Cookie(4), Type(1), Port(2), Name(32)
-    packet = struct.pack("!IBH32s", MAGIC_COOKIE, OFFER_TYPE, tcp_port, server_name)
-    print(f"Starting UDP broadcast on port {UDP_PORT} for TCP port {tcp_port}")
 
+def udp_broadcast(tcp_port, capacity=0, load=None):
+    """
+    Broadcasts offer every 1 second, and answers client probes at once with a unicast offer.
+    Offers carry the server's load, and stop while the server is saturated.
+    :param capacity: Connections the server serves at once, 0 for no limit
+    :param load: Callable returning the connections being served, defaults to this process's
+    """
+    load = load or metrics.ACTIVE_CONNECTIONS.value
+    # Bound to the discovery port to receive probes, shared with clients on the same machine
+    udp_sock = discovery.bind_udp_port()
+    udp_sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+    logger.info("Starting UDP broadcast on port %d for TCP port %d", UDP_PORT, tcp_port)
+
+    saturated = False
+
+    def offer():
+        """
+        Offer: Cookie(4), Type(1), Port(2), Name(32), Load(2), Capacity(2)
+        :return: The offer packet, or None while the server is saturated
+        """
+        nonlocal saturated
+        current = load()
+        if saturated != bool(capacity and current >= capacity):
+            saturated = not saturated
+            if saturated:
+                logger.info("Server saturated, offers paused.")
+                # A last offer showing the server full, so clients drop it from their caches now
+                udp_sock.sendto(protocol.pack_offer(tcp_port, "BlackjackServer", current, capacity),
+                                ('<broadcast>', UDP_PORT))
+            else:
+                logger.info("Server has room again, offers resumed.")
+        return None if saturated else protocol.pack_offer(tcp_port, "BlackjackServer", current, capacity)
+
+    next_offer = time.monotonic()
     while True:
         try:
-            udp_sock.sendto(packet, ('<broadcast>', UDP_PORT))
-            time.sleep(1)
+            wait = next_offer - time.monotonic()
+            if wait <= 0:
+                packet = offer()
+                if packet:
+                    udp_sock.sendto(packet, ('<broadcast>', UDP_PORT))
+                    metrics.OFFERS_SENT.inc()
+                next_offer = max(next_offer + 1, time.monotonic())
+                continue
+
+            udp_sock.settimeout(wait)
+            try:
+                data, addr = udp_sock.recvfrom(1024)
+            except socket.timeout:
+                continue
+            if protocol.is_probe(data):
+                packet = offer()
+                if packet:
+                    udp_sock.sendto(packet, addr)
+                    metrics.OFFERS_SENT.inc()
         except Exception as e:
-            print(f"Error in UDP broadcast: {e}")
+            logger.error("Error in UDP broadcast: %s", e)
             time.sleep(1)
+            next_offer = time.monotonic()
+
+
+class ServerConfig:
+    """
+    Server settings, filled from the command line.
+    """
 
+    def __init__(self, mode="threaded", backlog=DEFAULT_BACKLOG, max_games=None, decks=1,
+                 penetration=None, pregenerate=0, workers=1, grace=DRAIN_TIMEOUT, port=0,
+                 log_level="DEBUG", event_log=None, metrics_port=None, max_queued=None,
+                 handshake_timeout=HANDSHAKE_TIMEOUT, decision_timeout=CLIENT_TIMEOUT, report_ev=False,
+                 history=None, leaderboard=None, record=None, idle_timeout=IDLE_TIMEOUT):
+        self.mode = mode                # "threaded" for a thread per connection, "async" for a coroutine per game
+        self.backlog = backlog          # Listen backlog of the TCP socket
+        self.max_games = max_games      # Maximum number of games played concurrently (None for no limit)
+        self.decks = decks              # Decks per shoe
+        self.penetration = penetration  # Fraction of the shoe dealt before reshuffling (None for every round)
+        self.pregenerate = pregenerate  # Batch size of NumPy pre-generated shuffles (0 to shuffle per shoe)
+        self.workers = workers          # Worker processes sharing the port (1 to serve in this process)
+        self.grace = grace              # Seconds running games get to finish on shutdown
+        self.port = port                # TCP port, 0 for an ephemeral port
+        self.log_level = log_level      # Console log level, per-card messages are DEBUG
+        self.event_log = event_log      # Path of the JSONL game-event log (None for no event log)
+        self.metrics_port = metrics_port  # Local HTTP port of the metrics endpoint (None for no endpoint),
+                                          # worker i of a multi-process server uses metrics_port + i
+        self.max_queued = max_queued    # Connections waiting for a game beyond max_games (None for no limit),
+                                        # more are rejected with a BUSY payload
+        self.handshake_timeout = handshake_timeout  # Seconds a client has to send its request
+        self.decision_timeout = decision_timeout    # Seconds a client has for each decision
+        self.report_ev = report_ev      # Report each round's basic-strategy expected value
+        self.history = history          # Path of the SQLite game-history database (None for no history)
+        self.leaderboard = leaderboard  # Snapshot file of the live leaderboard (None for no leaderboard),
+                                        # worker i of a multi-process server uses FILE.i
+        self.record = record            # Path of the session recording file (None to not record)
+        self.idle_timeout = idle_timeout  # Seconds a kept-alive connection waits for its next request,
+                                          # it keeps its game slot meanwhile
+
+    def capacity(self):
+        """
+        :return: Connections the whole server serves at once, 0 for no limit
+        """
+        return self.max_games * self.workers if self.max_games else 0
+
+    def admission_limit(self):
+        """
+        :return: Connections admitted at once, playing or waiting for a game, None for no limit
+        """
+        if self.max_games and self.max_queued is not None:
+            return self.max_games + self.max_queued
+        return None
+
+    def shoe_factory(self):
+        """
+        :return: Callable creating the shoe of each connection. Call it in the process that
+                 serves the games, so forked workers do not share shuffles.
+        """
+        shuffles = PregeneratedShuffles(self.decks, self.pregenerate) if self.pregenerate else None
+        return functools.partial(Shoe, self.decks, self.penetration, shuffles=shuffles)
+
+
+def start_services(config, worker=None):
+    """
+    Start the background services the config turns on in this process: game history,
+    leaderboard and session recording (see background).
+    :param worker: Index of a forked worker, None for a single-process server
+    """
+    if config.history:
+        history.start(config.history)  # One writer per worker, SQLite serializes their batches
+    if config.leaderboard:
+        leaderboard.start(config.leaderboard if worker is None else f"{config.leaderboard}.{worker}")
+    if config.record:
+        recording.start(config.record, config.decks, config.penetration)
+
+
+def create_listener(backlog, port=0, reuse_port=False):
+    """
+    Bind and listen on a TCP socket.
+    :param port: Port to bind, 0 for an ephemeral port
+    :param reuse_port: Let other processes listen on the same port (SO_REUSEPORT)
+    """
+    tcp_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    if reuse_port:
+        tcp_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    tcp_sock.bind(("", port))
+    tcp_sock.listen(backlog)
+    return tcp_sock
+
+
+def start_server(config=None):
+    """
+    Start the game server.
+    :param config: ServerConfig, defaults to a single threaded process
+    """
+    config = config or ServerConfig()
+    if config.record and config.pregenerate:
+        # Replays rebuild every shoe from its seed
+        raise ValueError("Recording sessions needs per-shoe shuffles, it cannot be used with pregenerate")
+    gamelog.configure(config.log_level, config.event_log)
+    if config.report_ev:
+        strategy.tables()  # Loaded once here, forked workers inherit them
 
-def start_server():
     # Find local IP
     try:
         ip_address = socket.gethostbyname(socket.gethostname())
     except:
         ip_address = '127.0.0.1'
 
+    if config.workers > 1:
+        import supervisor
+        supervisor.run_workers(config, ip_address)
+        return
+
+    start_services(config)
+
     # Setup TCP
-    tcp_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    tcp_sock.bind(("", 0))  # Ephemeral port
-    tcp_sock.listen(5)
+    tcp_sock = create_listener(config.backlog, config.port)
     tcp_port = tcp_sock.getsockname()[1]
 
-    print(f"Server started, listening on IP address {ip_address}, Port {tcp_port}")
+    logger.info("Server started (%s), listening on IP address %s, Port %d", config.mode, ip_address, tcp_port)
 
     # Start UDP Broadcast thread
-    t = threading.Thread(target=udp_broadcast, args=(tcp_port,), daemon=True)
+    t = threading.Thread(target=udp_broadcast, args=(tcp_port, config.capacity()), daemon=True)
     t.start()
+    if config.metrics_port is not None:
+        metrics.start_http_server(config.metrics_port)
+        logger.info("Metrics on http://127.0.0.1:%d/metrics", config.metrics_port)
+
+    # SIGTERM shuts down as gracefully as Ctrl-C
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        serve(tcp_sock, config)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        logger.info("Server shutting down.")
+        logger.info("Close Connection")
+        tcp_sock.close()
+
+
+def serve(tcp_sock, config, stop_signals=(signal.SIGINT, signal.SIGTERM)):
+    """
+    Serve games on a listening socket until a stop signal, in the configured mode.
+    :param stop_signals: Signals that stop the server (used by the asyncio server, the threaded
+                         server stops on KeyboardInterrupt)
+    """
+    if config.mode == "async":
+        import async_server
+        asyncio.run(async_server.serve(tcp_sock, config, stop_signals))
+    else:
+        serve_threaded(tcp_sock, config)
+
+
+def serve_threaded(tcp_sock, config):
+    """
+    Accept loop of the threaded server, one daemon thread per connection.
+    When max_games is set, new connections wait for a game to end, for up to handshake_timeout
+    seconds; once max_queued are waiting, more are rejected at once.
+    On KeyboardInterrupt it stops accepting and gives running games config.grace seconds to finish.
+    """
+    make_shoe = config.shoe_factory()
+    slots = threading.BoundedSemaphore(config.max_games) if config.max_games else None
+    limit = config.admission_limit()
+    admitted = threading.BoundedSemaphore(limit) if limit else None
+    games = set()
+
+    def run_game(conn, addr):
+        try:
+            if slots and not slots.acquire(timeout=config.handshake_timeout):
+                reject(conn, addr)
+                return
+            try:
+                handle_client(conn, addr, make_shoe, config.handshake_timeout, config.decision_timeout,
+                              idle_timeout=config.idle_timeout)
+            finally:
+                if slots:
+                    slots.release()
+        finally:
+            games.discard(threading.current_thread())
+            metrics.retire_thread()
+            if admitted:
+                admitted.release()
 
     try:
         while True:
             conn, addr = tcp_sock.accept()
-            t_client = threading.Thread(target=handle_client, args=(conn, addr), daemon=True)
+            if admitted and not admitted.acquire(blocking=False):
+                reject(conn, addr)
+                continue
+            t_client = threading.Thread(target=run_game, args=(conn, addr), daemon=True)
+            games.add(t_client)
             t_client.start()
     except KeyboardInterrupt:
-        print("Server shutting down.")
-    finally:
-        print("Close Connection")
         tcp_sock.close()
+        if games:
+            logger.info("Waiting for %d running games to finish...", len(games))
+        deadline = time.monotonic() + config.grace
+        for t_client in list(games):
+            t_client.join(max(0.0, deadline - time.monotonic()))
+        raise
+
 
 if __name__ == "__main__":
-    start_server()
+    parser = argparse.ArgumentParser(description="Blackjack game server")
+    parser.add_argument("--mode", choices=["threaded", "async"], default="threaded")
+    parser.add_argument("--backlog", type=int, default=DEFAULT_BACKLOG)
+    parser.add_argument("--max-games", type=int, default=None,
+                        help="maximum number of concurrent games")
+    parser.add_argument("--max-queued", type=int, default=None,
+                        help="connections waiting for a game beyond --max-games, more are rejected")
+    parser.add_argument("--handshake-timeout", type=float, default=HANDSHAKE_TIMEOUT,
+                        help="seconds a client has to send its request")
+    parser.add_argument("--decision-timeout", type=float, default=CLIENT_TIMEOUT,
+                        help="seconds a client has for each decision")
+    parser.add_argument("--idle-timeout", type=float, default=IDLE_TIMEOUT,
+                        help="seconds a kept-alive connection waits for its next request")
+    parser.add_argument("--decks", type=int, default=1, help="number of decks in the shoe")
+    parser.add_argument("--penetration", type=float, default=None,
+                        help="fraction of the shoe dealt before reshuffling (default: every round)")
+    parser.add_argument("--pregenerate", type=int, default=0, metavar="BATCH",
+                        help="shuffle shoes in NumPy batches of this size")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="worker processes sharing the port with SO_REUSEPORT")
+    parser.add_argument("--grace", type=float, default=DRAIN_TIMEOUT,
+                        help="seconds running games get to finish on shutdown")
+    parser.add_argument("--port", type=int, default=0, help="TCP port (default: ephemeral)")
+    parser.add_argument("--log-level", default="DEBUG", type=str.upper,
+                        choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+                        help="console log level, per-card messages are DEBUG")
+    parser.add_argument("--event-log", metavar="FILE", help="append a JSONL game-event log to FILE")
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="serve Prometheus metrics and the profiler on this local port")
+    parser.add_argument("--report-ev", action="store_true",
+                        help="log each round's basic-strategy expected value next to the actual result")
+    parser.add_argument("--history", metavar="FILE", help="record finished games to the SQLite database FILE")
+    parser.add_argument("--leaderboard", metavar="FILE",
+                        help="keep live per-team results, snapshotted to FILE (served on --metrics-port)")
+    parser.add_argument("--record", metavar="FILE", help="record every session to FILE, for replay.py")
+    args = parser.parse_args()
+
+    start_server(ServerConfig(args.mode, args.backlog, args.max_games, args.decks, args.penetration,
+                              args.pregenerate, args.workers, args.grace, args.port,
+                              args.log_level, args.event_log, args.metrics_port, args.max_queued,
+                              args.handshake_timeout, args.decision_timeout, args.report_ev,
+                              args.history, args.leaderboard, args.record, args.idle_timeout))
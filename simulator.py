@@ -0,0 +1,186 @@
+# Headless Monte Carlo simulation of the server's blackjack rounds.
+# Plays hands in NumPy batches with the same rules as server.BlackjackGame: a freshly shuffled
+# shoe per hand, the dealer hits below DEALER_STANDS_ON, aces count 11 unless that busts the hand,
+# and results use the WIN/TIE/LOSS codes from constants.py.
+# Usage: python simulator.py --hands 1000000 --strategy 17 --workers 4
+#        python simulator.py --hands 1000000 --strategy basic
+import argparse
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import strategy as basic_strategy
+from cards import BLACKJACK, DEALER_STANDS_ON, DECK_SIZE, VALUES
+from constants import LOSS, TIE, WIN
+
+DEFAULT_BATCH = 100_000
+CARD_VALUES = np.frombuffer(VALUES, dtype=np.uint8).astype(np.int16)
+
+
+class HitBelow:
+    """
+    Player strategy: hit while the hand total is below a threshold.
+    A strategy is any picklable callable taking arrays of (player total, soft ace count,
+    dealer upcard value) and returning a boolean array, True where the player hits.
+    """
+
+    def __init__(self, threshold=DEALER_STANDS_ON):
+        self.threshold = threshold
+
+    def __call__(self, total, soft, dealer_up):
+        return total < self.threshold
+
+    def __repr__(self):
+        return f"HitBelow({self.threshold})"
+
+
+class BasicStrategy:
+    """
+    Player strategy: basic strategy from the precomputed tables of strategy.py, one table
+    lookup for the whole batch.
+    """
+
+    def __init__(self, tables=None):
+        tables = tables or basic_strategy.tables()
+        self.hit = np.frombuffer(tables.hit, dtype=np.uint8).astype(bool)
+
+    def __call__(self, total, soft, dealer_up):
+        rows = np.minimum(total, basic_strategy.MAX_TOTAL - 1) * 2 + (soft > 0)
+        return self.hit[rows * basic_strategy.UPCARDS + dealer_up]
+
+    def __repr__(self):
+        return "BasicStrategy()"
+
+
+def parse_strategy(name):
+    """
+    :param name: "basic", or the total HitBelow stands on
+    """
+    return BasicStrategy() if name == "basic" else HitBelow(int(name))
+
+
+def add_cards(total, soft, values, mask):
+    """
+    Vectorized Hand.add: add one card value to the hands selected by mask.
+    """
+    total[mask] += values[mask]
+    soft[mask] += values[mask] == 11
+    # Adjust for aces if bust (at most two aces can need reducing after one card)
+    for _ in range(2):
+        reduce = (total > BLACKJACK) & (soft > 0)
+        total[reduce] -= 10
+        soft[reduce] -= 1
+
+
+def play_batch(rng, size, strategy, decks=1):
+    """
+    Play one batch of independent hands.
+    :param rng: numpy Generator
+    :param size: Number of hands
+    :param strategy: Player strategy, see HitBelow
+    :param decks: Decks per shoe, shuffled fresh for every hand
+    :return: Array of result codes, one per hand
+    """
+    shoes = rng.permuted(np.tile(np.arange(DECK_SIZE, dtype=np.uint8), (size, decks)), axis=1)
+    values = CARD_VALUES[shoes]
+    rows = np.arange(size)
+
+    # Deal: player gets the first two cards, the dealer the next two (the second one hidden)
+    zeros = np.zeros(size, dtype=np.int16)
+    everyone = np.ones(size, dtype=bool)
+    p_total, p_soft = zeros.copy(), zeros.copy()
+    d_total, d_soft = zeros.copy(), zeros.copy()
+    add_cards(p_total, p_soft, values[:, 0], everyone)
+    add_cards(p_total, p_soft, values[:, 1], everyone)
+    add_cards(d_total, d_soft, values[:, 2], everyone)
+    dealer_up = d_total.copy()
+    add_cards(d_total, d_soft, values[:, 3], everyone)
+    next_card = np.full(size, 4)
+
+    # Player's turn: hands keep hitting while the strategy says so and they did not bust
+    active = strategy(p_total, p_soft, dealer_up)
+    while active.any():
+        add_cards(p_total, p_soft, values[rows, next_card], active)
+        next_card += active
+        active &= p_total <= BLACKJACK
+        active &= strategy(p_total, p_soft, dealer_up)
+    busted = p_total > BLACKJACK
+
+    # Dealer's turn, only against players that did not bust
+    active = ~busted & (d_total < DEALER_STANDS_ON)
+    while active.any():
+        add_cards(d_total, d_soft, values[rows, next_card], active)
+        next_card += active
+        active &= d_total < DEALER_STANDS_ON
+
+    # Same settlement as cards.settle
+    results = np.full(size, LOSS, dtype=np.uint8)
+    standing = ~busted
+    results[standing & ((d_total > BLACKJACK) | (p_total > d_total))] = WIN
+    results[standing & (d_total <= BLACKJACK) & (p_total == d_total)] = TIE
+    return results
+
+
+def simulate_chunk(hands, strategy, seed, batch=DEFAULT_BATCH, decks=1):
+    """
+    Play hands in batches in the current process.
+    :return: (wins, ties, losses)
+    """
+    rng = np.random.default_rng(seed)
+    counts = np.zeros(4, dtype=np.int64)
+    while hands > 0:
+        size = min(batch, hands)
+        counts += np.bincount(play_batch(rng, size, strategy, decks), minlength=4)
+        hands -= size
+    return int(counts[WIN]), int(counts[TIE]), int(counts[LOSS])
+
+
+def simulate(hands, strategy=None, workers=1, batch=DEFAULT_BATCH, decks=1, seed=None):
+    """
+    Play hands, spread across a process pool when workers > 1.
+    :return: Report dict with counts, rates and hands per second
+    """
+    strategy = strategy or HitBelow()
+    seeds = np.random.SeedSequence(seed).spawn(workers)
+    share = [hands // workers + (i < hands % workers) for i in range(workers)]
+
+    start = time.perf_counter()
+    if workers == 1:
+        chunks = [simulate_chunk(hands, strategy, seeds[0], batch, decks)]
+    else:
+        with ProcessPoolExecutor(workers) as pool:
+            chunks = list(pool.map(simulate_chunk, share, [strategy] * workers, seeds,
+                                   [batch] * workers, [decks] * workers))
+    elapsed = time.perf_counter() - start
+
+    wins, ties, losses = (sum(chunk[i] for chunk in chunks) for i in range(3))
+    return {
+        "hands": hands,
+        "wins": wins,
+        "ties": ties,
+        "losses": losses,
+        "win_rate": wins / hands,
+        "tie_rate": ties / hands,
+        "loss_rate": losses / hands,
+        # Even-money payouts: the house wins a unit on each loss and pays one on each win
+        "house_edge": (losses - wins) / hands,
+        "seconds": elapsed,
+        "hands_per_second": hands / elapsed if elapsed else float("inf"),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Monte Carlo blackjack simulator")
+    parser.add_argument("--hands", type=int, default=1_000_000)
+    parser.add_argument("--strategy", type=parse_strategy, default=HitBelow(), metavar="TOTAL|basic",
+                        help="player hits while below this total, or plays basic strategy")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--batch", type=int, default=DEFAULT_BATCH)
+    parser.add_argument("--decks", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    report = simulate(args.hands, args.strategy, args.workers, args.batch, args.decks, args.seed)
+    print(f"Hands: {report['hands']}  |  Strategy: {args.strategy}")
+    print(f"Win: {report['win_rate']:.2%}  Tie: {report['tie_rate']:.2%}  Loss: {report['loss_rate']:.2%}")
+    print(f"House edge: {report['house_edge']:.2%}")
+    print(f"{report['hands_per_second']:,.0f} hands/sec ({report['seconds']:.2f}s)")
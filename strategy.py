@@ -0,0 +1,195 @@
+# Precomputed dealer-outcome and basic-strategy tables for the game's rules.
+# The tables use the infinite-deck approximation (every card value has a fixed probability),
+# which is close for the single-deck-per-round shoes the server deals. They are computed once,
+# cached to disk as JSON and then read in O(1):
+#   dealer_outcomes(upcard)              probabilities of the dealer ending on 17-21 or busting
+#   should_hit(total, soft, upcard)      basic strategy: hit or stand
+#   expected_value(total, soft, upcard)  EV of the hand with basic strategy, in bets (+1 win, -1 loss)
+# Upcards are card values 2-11 (Ace is 11), soft is True while an ace counts 11.
+import json
+import os
+from array import array
+from functools import lru_cache
+from cards import BLACKJACK, DEALER_STANDS_ON
+
+CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "blackjack", "strategy.json")
+RULES = {"version": 1, "blackjack": BLACKJACK, "dealer_stands_on": DEALER_STANDS_ON}
+
+# Probability of drawing each card value, index 11 is the Ace
+CARD_PROBABILITIES = {value: (4 if value == 10 else 1) / 13 for value in range(2, 12)}
+DEALER_FINALS = tuple(range(DEALER_STANDS_ON, BLACKJACK + 1))  # Dealer totals before bust
+MAX_TOTAL = 32  # Table rows: totals 0-31
+UPCARDS = 12    # Table columns: upcard values 0-11 (2-11 used)
+
+
+def add_card(total, soft, value):
+    """
+    Same as Hand.add, on a (total, soft aces) state.
+    :return: (total, soft aces) after the card
+    """
+    total += value
+    soft += value == 11
+    while total > BLACKJACK and soft:
+        total -= 10
+        soft -= 1
+    return total, soft
+
+
+def index(total, soft, upcard):
+    return ((total << 1) | bool(soft)) * UPCARDS + upcard
+
+
+@lru_cache(maxsize=None)
+def _dealer_from(total, soft):
+    # Final total distribution: one entry per DEALER_FINALS, then bust
+    if total > BLACKJACK:
+        return (0.0,) * len(DEALER_FINALS) + (1.0,)
+    if total >= DEALER_STANDS_ON:
+        return tuple(float(total == final) for final in DEALER_FINALS) + (0.0,)
+    outcome = [0.0] * (len(DEALER_FINALS) + 1)
+    for value, p in CARD_PROBABILITIES.items():
+        for i, q in enumerate(_dealer_from(*add_card(total, soft, value))):
+            outcome[i] += p * q
+    return tuple(outcome)
+
+
+def _stand_ev(total, dealer):
+    if total > BLACKJACK:
+        return -1.0
+    ev = dealer[-1]  # Dealer busts
+    for final, p in zip(DEALER_FINALS, dealer):
+        if total > final:
+            ev += p
+        elif total < final:
+            ev -= p
+    return ev
+
+
+class StrategyTables:
+    """
+    The precomputed tables, see the module comment.
+    """
+    __slots__ = ("dealer", "hit", "ev")
+
+    def __init__(self, dealer, hit, ev):
+        self.dealer = dealer  # dealer[upcard] -> (P(17), ..., P(21), P(bust))
+        self.hit = hit        # bytes, 1 where basic strategy hits, see index()
+        self.ev = ev          # array of doubles, see index()
+
+    def dealer_outcomes(self, upcard):
+        return self.dealer[upcard]
+
+    def should_hit(self, total, soft, upcard):
+        return self.hit[index(min(total, MAX_TOTAL - 1), soft, upcard)] == 1
+
+    def expected_value(self, total, soft, upcard):
+        return self.ev[index(min(total, MAX_TOTAL - 1), soft, upcard)]
+
+    def stand_totals(self, upcard):
+        """
+        Basic strategy against one upcard as a decision plan (see protocol.pack_plan): it hits
+        every hard and soft total below these and stands on every total from them up.
+        :return: (hard, soft) stand totals
+        """
+        hard, soft = BLACKJACK, BLACKJACK
+        while hard > 4 and not self.should_hit(hard - 1, False, upcard):
+            hard -= 1
+        while soft > 12 and not self.should_hit(soft - 1, True, upcard):
+            soft -= 1
+        return hard, soft
+
+    def to_json(self):
+        return {"rules": RULES, "dealer": self.dealer, "hit": list(self.hit), "ev": list(self.ev)}
+
+    @classmethod
+    def from_json(cls, data):
+        dealer = [tuple(row) for row in data["dealer"]]
+        return cls(dealer, bytes(data["hit"]), array("d", data["ev"]))
+
+
+def build():
+    """
+    Compute the tables from scratch (a few milliseconds).
+    """
+    dealer = [()] * UPCARDS
+    hit = bytearray(MAX_TOTAL * 2 * UPCARDS)
+    ev = array("d", bytes(8 * len(hit)))
+    for upcard in range(2, 12):
+        dealer[upcard] = _dealer_from(upcard, int(upcard == 11))
+
+        @lru_cache(maxsize=None)
+        def best(total, soft):
+            # (EV, hit) of the best play from this hand
+            stand = _stand_ev(total, dealer[upcard])
+            if total >= BLACKJACK:
+                return stand, False
+            hit_ev = 0.0
+            for value, p in CARD_PROBABILITIES.items():
+                next_total, next_soft = add_card(total, soft, value)
+                hit_ev += p * (-1.0 if next_total > BLACKJACK else best(next_total, next_soft)[0])
+            return (hit_ev, True) if hit_ev > stand else (stand, False)
+
+        for total in range(MAX_TOTAL):
+            for soft in (0, 1):
+                value, hits = best(total, soft) if total <= BLACKJACK else (-1.0, False)
+                ev[index(total, soft, upcard)] = value
+                hit[index(total, soft, upcard)] = hits
+    return StrategyTables(dealer, bytes(hit), ev)
+
+
+def load(path=CACHE_PATH):
+    """
+    Read the tables from the disk cache, or build and cache them if it is missing or was
+    built for other rules.
+    """
+    try:
+        with open(path) as f:
+            data = json.load(f)
+        if data.get("rules") == RULES:
+            return StrategyTables.from_json(data)
+    except (OSError, ValueError, KeyError):
+        pass
+
+    tables = build()
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(tables.to_json(), f)
+        os.replace(tmp, path)
+    except OSError:
+        pass  # Read-only home, the tables still work from memory
+    return tables
+
+
+_tables = None
+
+
+def loaded():
+    """
+    :return: The process's tables if something loaded them already, else None
+    """
+    return _tables
+
+
+def tables():
+    """
+    :return: The process's tables, loaded on first use
+    """
+    global _tables
+    if _tables is None:
+        _tables = load()
+    return _tables
+
+
+if __name__ == "__main__":
+    t = tables()
+    names = {11: "A"}
+    print("Basic strategy (H = hit, S = stand), dealer upcard across")
+    print("       " + " ".join(f"{names.get(up, up):>2}" for up in range(2, 12)))
+    for soft in (0, 1):
+        for total in range(12 if soft else 5, BLACKJACK + 1):
+            row = " ".join(" H" if t.should_hit(total, soft, up) else " S" for up in range(2, 12))
+            print(f"{'soft' if soft else 'hard'} {total:>2} {row}")
+    print("\nDealer bust probability by upcard")
+    print(" ".join(f"{names.get(up, up)}:{t.dealer_outcomes(up)[-1]:.1%}" for up in range(2, 12)))
@@ -0,0 +1,142 @@
+# Multi-process server: a supervisor process forks worker processes that all accept on the
+# same TCP port with SO_REUSEPORT, so the kernel spreads connections across them and each
+# worker plays its games under its own GIL. Linux/BSD only (needs fork and SO_REUSEPORT).
+import mmap
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+import background
+import gamelog
+import metrics
+import server
+from gamelog import logger
+
+RESTART_DELAY = 1  # Seconds to wait before restarting a worker that died right after starting
+LOAD_INTERVAL = 0.25  # Seconds between two updates of a worker's load for the offers
+
+
+def run_workers(config, ip_address):
+    """
+    Fork config.workers worker processes and supervise them until SIGINT/SIGTERM.
+    Workers that exit unexpectedly are restarted. On shutdown every worker gets SIGTERM and
+    config.grace seconds to finish its running games before it is killed.
+    """
+    # Reserve the port without listening on it, so workers can always rebind it with SO_REUSEPORT
+    # (the kernel only hands connections to listening sockets)
+    reserved = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    reserved.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    reserved.bind(("", config.port))
+    tcp_port = reserved.getsockname()[1]
+
+    logger.info("Server started (%s, %d workers), listening on IP address %s, Port %d",
+                config.mode, config.workers, ip_address, tcp_port)
+
+    # Connections each worker is serving, in memory shared with the forked workers, so the
+    # worker that broadcasts offers can advertise the load of the whole server
+    loads = memoryview(mmap.mmap(-1, 4 * config.workers)).cast("I")
+
+    workers = {}  # pid -> (worker index, start time)
+    stopping = False
+
+    def spawn(index):
+        gamelog.shutdown()  # Write out queued records, or the child prints them again
+        sys.stdout.flush()
+        pid = os.fork()
+        if pid == 0:
+            reserved.close()
+            worker_main(index, tcp_port, config, loads)
+        gamelog.configure(config.log_level, config.event_log)
+        workers[pid] = (index, time.monotonic())
+
+    def request_stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+    for index in range(config.workers):
+        spawn(index)
+
+    try:
+        while not stopping:
+            pid, status = os.wait()
+            index, started = workers.pop(pid)
+            loads[index] = 0
+            if stopping:
+                break
+            logger.warning("Worker %d (pid %d) exited with status %d, restarting.",
+                           index, pid, os.waitstatus_to_exitcode(status))
+            if time.monotonic() - started < RESTART_DELAY:
+                time.sleep(RESTART_DELAY)
+            spawn(index)
+
+        logger.info("Server shutting down.")
+        # Workers drain their games, kill whatever is left after the grace period
+        deadline = time.monotonic() + config.grace + 1
+        while workers:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if pid:
+                workers.pop(pid, None)
+            elif time.monotonic() > deadline:
+                for pid in list(workers):
+                    os.kill(pid, signal.SIGKILL)
+                deadline = float("inf")
+            else:
+                time.sleep(0.1)
+    finally:
+        logger.info("Close Connection")
+        reserved.close()
+
+
+def worker_main(index, tcp_port, config, loads):
+    """
+    Body of a forked worker: serve games on the shared port until SIGTERM, never returns.
+    Only worker 0 broadcasts offers.
+    :param loads: Shared load of every worker, this worker updates loads[index]
+    """
+    # Ctrl-C reaches the whole process group, let the supervisor coordinate the shutdown
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    # The parent's background threads are gone in this process (see background), start our own
+    gamelog.configure(config.log_level, config.event_log)
+    code = 0
+    try:
+        server.start_services(config, index)
+        tcp_sock = server.create_listener(config.backlog, tcp_port, reuse_port=True)
+        threading.Thread(target=publish_load, args=(loads, index), daemon=True).start()
+        if index == 0:
+            t = threading.Thread(target=server.udp_broadcast, daemon=True,
+                                 args=(tcp_port, config.capacity(), lambda: sum(loads)))
+            t.start()
+        if config.metrics_port is not None:
+            metrics.start_http_server(config.metrics_port + index)
+        try:
+            server.serve(tcp_sock, config, stop_signals=(signal.SIGTERM,))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            tcp_sock.close()
+    except BaseException as e:
+        logger.error("Worker %d failed: %s", index, e)
+        code = 1
+    finally:
+        background.stop_all()
+        # Never fall back into the supervisor's code
+        os._exit(code)
+
+
+def publish_load(loads, index):
+    """
+    Copy this worker's connection count into the shared loads.
+    """
+    while True:
+        loads[index] = metrics.ACTIVE_CONNECTIONS.value()
+        time.sleep(LOAD_INTERVAL)
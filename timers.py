@@ -0,0 +1,118 @@
+# Connection deadlines on a hashed timer wheel.
+# Every connection has one timer that is pushed back on each message it receives; when it
+# expires the connection is cut off. Scheduling, pushing back and cancelling are O(1), and the
+# sockets stay in plain blocking mode: a socket timeout would add a poll() call to every recv().
+import asyncio
+import math
+import threading
+import time
+
+TICK = 0.25        # Seconds per wheel slot, deadlines fire up to one tick late
+WHEEL_SIZE = 512   # Slots, one turn of the wheel covers WHEEL_SIZE * TICK seconds
+
+
+class Timer:
+    """
+    A scheduled callback, owned by the wheel that created it.
+    """
+    __slots__ = ("expires", "callback", "slot")
+
+    def __init__(self, callback):
+        self.expires = 0      # Tick the timer fires at
+        self.callback = callback
+        self.slot = None      # Set of the slot the timer is in, None when not scheduled
+
+
+class TimerWheel:
+    """
+    Hashed timer wheel: a timer sits in slot (expiry tick % size), and advance() walks the slots
+    of the ticks that passed, firing the timers that are due. Timers further than one turn
+    away are skipped until their turn comes.
+    Thread-safe; callbacks run in the thread that calls advance(), outside the lock.
+    """
+
+    def __init__(self, tick=TICK, size=WHEEL_SIZE):
+        self.tick = tick
+        self.slots = [set() for _ in range(size)]
+        self.origin = time.monotonic()
+        self.current = 0  # Last tick processed
+        self.lock = threading.Lock()
+
+    def schedule(self, timeout, callback):
+        """
+        :param timeout: Seconds until the callback runs
+        :return: Timer, to reschedule or cancel it
+        """
+        timer = Timer(callback)
+        self.reschedule(timer, timeout)
+        return timer
+
+    def reschedule(self, timer, timeout):
+        """
+        Move a timer (scheduled, fired or cancelled) to timeout seconds from now.
+        """
+        expires = math.ceil((time.monotonic() + timeout - self.origin) / self.tick)
+        with self.lock:
+            if timer.slot is not None:
+                timer.slot.discard(timer)
+            timer.expires = max(expires, self.current + 1)
+            timer.slot = self.slots[timer.expires % len(self.slots)]
+            timer.slot.add(timer)
+
+    def cancel(self, timer):
+        with self.lock:
+            if timer.slot is not None:
+                timer.slot.discard(timer)
+                timer.slot = None
+
+    def advance(self):
+        """
+        Fire the timers that are due.
+        :return: Number of timers fired
+        """
+        target = int((time.monotonic() - self.origin) / self.tick)
+        due = []
+        with self.lock:
+            while self.current < target:
+                self.current += 1
+                slot = self.slots[self.current % len(self.slots)]
+                expired = [timer for timer in slot if timer.expires <= self.current]
+                for timer in expired:
+                    slot.discard(timer)
+                    timer.slot = None
+                due.extend(expired)
+        for timer in due:
+            timer.callback()
+        return len(due)
+
+    def run(self):
+        """
+        Advance the wheel forever, for a daemon thread.
+        """
+        while True:
+            time.sleep(self.tick)
+            self.advance()
+
+    async def run_async(self):
+        """
+        Advance the wheel from an asyncio task, callbacks then run in the event loop.
+        """
+        while True:
+            await asyncio.sleep(self.tick)
+            self.advance()
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared_wheel():
+    """
+    :return: The process's wheel driven by a daemon thread, started on first use
+    """
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = TimerWheel()
+            threading.Thread(target=_shared.run, name="timer-wheel", daemon=True).start()
+        return _shared